@@ -0,0 +1,106 @@
+import random
+import string
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.profiles.models import (
+    TECH_ANALYSIS_KINDS,
+    TechAnalysis,
+    build_aggregated_analysis,
+)
+
+
+def random_word(rnd, length=8):
+    return "".join(rnd.choices(string.ascii_lowercase, k=length))
+
+
+def build_tech_analysis_repo(rnd):
+    """A repo shaped like the ones posted to `add_tech_analysis_repo`"""
+    return {
+        kind: {
+            f"{random_word(rnd, 2)}.{random_word(rnd, 3)}": {
+                "insertions": rnd.randint(0, 10 ** 5),
+                "deletions": rnd.randint(0, 10 ** 5),
+            }
+            for _ in range(rnd.randint(5, 40))
+        }
+        for kind in TECH_ANALYSIS_KINDS
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the cost of a repo update through `TechAnalysis."
+        "update_repos` with a full save (load, change, rebuild the aggregate "
+        "and write the whole document), for growing repo counts. Runs against "
+        "the database in a transaction which is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repos",
+            type=int,
+            nargs="+",
+            default=[10, 100, 300, 1000],
+            help="Repo counts to benchmark (default: 10 100 300 1000)",
+        )
+        parser.add_argument(
+            "--saves",
+            type=int,
+            default=20,
+            help="Repo updates timed per repo count (default: 20)",
+        )
+
+    def handle(self, repos, saves, **options):
+        with transaction.atomic():
+            for repo_count in repos:
+                self.benchmark(repo_count, saves)
+
+            # Nothing of the benchmark is kept
+            transaction.set_rollback(True)
+
+    def benchmark(self, repo_count, saves):
+        rnd = random.Random(repo_count)
+
+        user = get_user_model().objects.create_user(
+            username=f"benchmark-{uuid.uuid4().hex[:12]}",
+            email=f"benchmark-{uuid.uuid4().hex}@example.com",
+        )
+        repo_names = [
+            f"{random_word(rnd)}/{random_word(rnd)}" for _ in range(repo_count)
+        ]
+        TechAnalysis.objects.create(
+            user=user,
+            repos={name: build_tech_analysis_repo(rnd) for name in repo_names},
+        )
+        updates = [
+            (rnd.choice(repo_names), build_tech_analysis_repo(rnd))
+            for _ in range(saves)
+        ]
+
+        # What a repo update did before `update_repos`
+        start = time.perf_counter()
+        for name, repo in updates:
+            tech_analysis = TechAnalysis.objects.get(user=user)
+            tech_analysis.repos[name] = repo
+            tech_analysis.save()
+        full_time = (time.perf_counter() - start) / saves
+
+        start = time.perf_counter()
+        for name, repo in updates:
+            TechAnalysis.update_repos(user.id, {name: repo})
+        incremental_time = (time.perf_counter() - start) / saves
+
+        tech_analysis = TechAnalysis.objects.get(user=user)
+        assert tech_analysis.aggregated_analysis == (
+            build_aggregated_analysis(tech_analysis.repos)
+        )
+        self.stdout.write(
+            f"{repo_count:>6} repos: full save "
+            f"{full_time * 1000:8.3f}ms/update, update_repos "
+            f"{incremental_time * 1000:8.3f}ms/update"
+        )
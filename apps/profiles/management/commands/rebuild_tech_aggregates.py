@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.profiles.models import TechAnalysis, build_aggregated_analysis
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies the incrementally maintained aggregated_analysis of every "
+        "tech analysis against a full rebuild from its repos, and optionally "
+        "repairs mismatches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "user_ids", nargs="*", help="Only check these users' analyses"
+        )
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Store the rebuilt aggregate of mismatching analyses",
+        )
+
+    def handle(self, user_ids, fix, **options):
+        queryset = TechAnalysis.objects.all()
+        if user_ids:
+            queryset = queryset.filter(user_id__in=user_ids)
+
+        rows = queryset.values_list(
+            "id", "user_id", "repos", "aggregated_analysis"
+        )
+
+        checked = mismatched = 0
+        for tech_analysis_id, user_id, repos, aggregate in rows.iterator():
+            checked += 1
+            rebuilt = build_aggregated_analysis(repos)
+            if rebuilt == aggregate:
+                continue
+
+            mismatched += 1
+            self.stdout.write(f"Mismatching aggregate for user {user_id}")
+            if fix:
+                # Update, not save, so the pre_save signal can't interfere
+                TechAnalysis.objects.filter(id=tech_analysis_id).update(
+                    aggregated_analysis=rebuilt
+                )
+
+        self.stdout.write(
+            f"Checked {checked} tech analyses, {mismatched} mismatched"
+            + (" (fixed)" if fix and mismatched else "")
+        )
+        if mismatched and not fix:
+            raise CommandError("Run with --fix to repair the aggregates")
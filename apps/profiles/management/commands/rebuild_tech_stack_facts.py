@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.profiles.models import (
+    TechAnalysis,
+    TechLeaderboardEntry,
+    TechStackFact,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the tech stack fact table from the tech analyses, e.g. to "
+        "backfill it, and then the tech leaderboard"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "user_ids", nargs="*", help="Only rebuild these users' facts"
+        )
+
+    def handle(self, user_ids, **options):
+        queryset = TechAnalysis.objects.all()
+        if user_ids:
+            queryset = queryset.filter(user_id__in=user_ids)
+
+        rows = queryset.values_list("user_id", "repos")
+
+        rebuilt = 0
+        for user_id, repos in rows.iterator():
+            with transaction.atomic():
+                # One full refresh at the end beats one per user
+                TechStackFact.rebuild_user(
+                    user_id, repos, refresh_leaderboard=False
+                )
+            rebuilt += 1
+
+        self.stdout.write(f"Rebuilt the tech stack facts of {rebuilt} users")
+
+        TechLeaderboardEntry.refresh()
+        self.stdout.write("Refreshed the tech leaderboard")
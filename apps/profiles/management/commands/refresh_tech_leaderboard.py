@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.profiles.models import TECH_ANALYSIS_KINDS, TechLeaderboardEntry
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the tech leaderboard from the tech stack facts. Meant to "
+        "run on a schedule, and after backfilling the facts"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "categories",
+            nargs="*",
+            metavar="kind:category",
+            help="Only refresh these entries, e.g. libs:js.vue",
+        )
+
+    def handle(self, categories, **options):
+        pairs = None
+        if categories:
+            pairs = []
+            for category in categories:
+                kind, _, name = category.partition(":")
+                if kind not in TECH_ANALYSIS_KINDS or not name:
+                    raise CommandError(f"Invalid category {category}")
+                pairs.append((kind, name))
+
+        TechLeaderboardEntry.refresh(pairs)
+        self.stdout.write(
+            f"Tech leaderboard has {TechLeaderboardEntry.objects.count()} "
+            "entries"
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from apps.profiles.models import TECH_ANALYSIS_KINDS, TechStackFact
+
+
+class Command(BaseCommand):
+    help = "Lists the users with the most insertions in a lib, tech or tag"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=TECH_ANALYSIS_KINDS)
+        parser.add_argument("category", help="e.g. js.vue")
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=10,
+            help="Number of users to list (default: 10)",
+        )
+        parser.add_argument(
+            "--min-insertions",
+            type=int,
+            help="Only list users with at least this many insertions",
+        )
+
+    def handle(self, kind, category, limit, min_insertions, **options):
+        top_users = TechStackFact.get_top_users(
+            kind, category, limit, min_insertions
+        )
+        for rank, user in enumerate(top_users, start=1):
+            self.stdout.write(
+                f"{rank:>3}. {user['username']} ({user['user_id']}): "
+                f"+{user['insertions']} -{user['deletions']} "
+                f"in {user['repos']} repos"
+            )
@@ -0,0 +1,24 @@
+# Generated by Django 2.2 on 2026-10-18 18:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0009_auto_20210127_2157'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repo',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='repo',
+            index=models.Index(fields=['full_name', '-updated_at'], name='profiles_repo_name_updated'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 18:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0010_repo_full_name_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repo',
+            name='analysis_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
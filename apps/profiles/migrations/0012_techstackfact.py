@@ -0,0 +1,36 @@
+# Generated by Django 2.2 on 2026-10-18 18:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('profiles', '0011_repo_analysis_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TechStackFact',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('repo_full_name', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[('libs', 'libs'), ('tech', 'tech'), ('tags', 'tags')], max_length=4)),
+                ('category', models.CharField(max_length=255)),
+                ('insertions', models.BigIntegerField()),
+                ('deletions', models.BigIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tech_stack_facts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='techstackfact',
+            index=models.Index(fields=['kind', 'category', 'user', 'insertions', 'deletions'], name='profiles_te_kind_6395f3_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='techstackfact',
+            unique_together={('user', 'repo_full_name', 'kind', 'category')},
+        ),
+    ]
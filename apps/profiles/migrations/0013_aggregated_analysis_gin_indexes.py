@@ -0,0 +1,23 @@
+# Generated by Django 2.2 on 2026-10-18 18:20
+
+from django.db import migrations
+
+KINDS = ["libs", "tech", "tags"]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0012_techstackfact'),
+    ]
+
+    # Expression indexes, which Django 2.2 can't declare in Meta.indexes
+    operations = [
+        migrations.RunSQL(
+            f"CREATE INDEX profiles_techanalysis_{kind}_gin "
+            f"ON profiles_techanalysis USING gin "
+            f"((aggregated_analysis -> '{kind}'))",
+            f"DROP INDEX profiles_techanalysis_{kind}_gin",
+        )
+        for kind in KINDS
+    ]
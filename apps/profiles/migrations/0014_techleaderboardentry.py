@@ -0,0 +1,35 @@
+# Generated by Django 2.2 on 2026-10-18 18:24
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0013_aggregated_analysis_gin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TechLeaderboardEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('libs', 'libs'), ('tech', 'tech'), ('tags', 'tags')], max_length=4)),
+                ('category', models.CharField(max_length=255)),
+                ('insertions', models.BigIntegerField()),
+                ('deletions', models.BigIntegerField()),
+                ('users', models.PositiveIntegerField()),
+                ('top_users', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='techleaderboardentry',
+            index=models.Index(fields=['kind', '-insertions'], name='profiles_tl_kind_insertions'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='techleaderboardentry',
+            unique_together={('kind', 'category')},
+        ),
+    ]
@@ -1,19 +1,44 @@
+import hashlib
+import json
 import logging
+import threading
+import time
 import uuid
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import JSONField
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models.signals import pre_save
+from django.db import (
+    close_old_connections,
+    connection,
+    models,
+    transaction,
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.dispatch import receiver
 from django.utils import timezone
+from psycopg2.extras import Json
 
 from apps.users.models import DeletedUser
 
 logger = logging.getLogger(__name__)
 
+TECH_LEADERBOARD_INCREMENTAL = settings.TECH_LEADERBOARD_INCREMENTAL
+TECH_LEADERBOARD_REFRESH_INTERVAL = settings.TECH_LEADERBOARD_REFRESH_INTERVAL
+TECH_LEADERBOARD_TOP_USERS = settings.TECH_LEADERBOARD_TOP_USERS
+TECH_LEADERBOARD_CACHE_TIMEOUT = settings.TECH_LEADERBOARD_CACHE_TIMEOUT
+# Serializes leaderboard refreshes (pg_advisory_xact_lock key)
+TECH_LEADERBOARD_LOCK_ID = 0x7EC41EAD
+
 
 class EmailAddress(models.Model):
     email = models.EmailField()
@@ -64,6 +89,52 @@ class BaseProfileModel(models.Model):
             f"<Profile provider: {self.provider}, username: {self.username}>"
         )
 
+    def patch_profile_analysis(self, patch):
+        """
+        Applies a patch to the stored `profile_analysis` in the database, so
+        the rest of the (possibly multi-megabyte) document is neither read
+        nor resent. Doesn't update the instance or send `post_save`.
+
+        Patch format:
+        {
+            "user_profile": {<field>: <value, or null to delete>, ...},
+            "repos": {"<ownerName>/<repoName>": <repo, or null to delete>},
+            "selectedRepos": [...]  (replaces the selected repos)
+        }
+        All keys are optional.
+        """
+        table = BaseProfileModel._meta.db_table
+        sql = f"{table}.profile_analysis"
+        params = []
+
+        for key in ["user_profile", "repos"]:
+            if key not in patch:
+                continue
+
+            changes = patch[key]
+            removed = [
+                name for name, value in changes.items() if value is None
+            ]
+            upserted = {
+                name: value
+                for name, value in changes.items()
+                if value is not None
+            }
+            sql = (
+                f"jsonb_set({sql}, %s, "
+                f"(COALESCE({table}.profile_analysis -> %s, '{{}}'::jsonb) "
+                "- %s::text[]) || %s::jsonb)"
+            )
+            params += [[key], key, removed, Json(upserted)]
+
+        if "selectedRepos" in patch:
+            sql = f"jsonb_set({sql}, %s, %s::jsonb)"
+            params += [["selectedRepos"], Json(patch["selectedRepos"])]
+
+        BaseProfileModel.objects.filter(pk=self.pk).update(
+            profile_analysis=RawSQL(sql, params)
+        )
+
 
 def get_profile_manager_by_provider(provider: str) -> models.Manager:
     """
@@ -138,13 +209,99 @@ class Repo(models.Model):
     # ID as per provider (e.g. GitHub)
     provider_repo_id = models.IntegerField(editable=False)
     provider = models.CharField(max_length=20, editable=False)
+    # Not unique: a renamed repo's old name can be taken by another repo
     full_name = models.CharField(max_length=255)
     repo_analysis = JSONField()
+    # See `get_analysis_hash`, lets upserts skip unchanged analyses
+    analysis_hash = models.CharField(max_length=64, blank=True, default="")
+    # When the analysis last changed
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Rows per INSERT statement of `upsert_analyses`
+    UPSERT_BATCH_SIZE = 500
 
     class Meta:
         unique_together = ("provider", "provider_repo_id")
+        indexes = [
+            # Serves `get_latest_by_full_name`
+            models.Index(
+                fields=["full_name", "-updated_at"],
+                name="profiles_repo_name_updated",
+            ),
+        ]
+
+    @classmethod
+    def get_latest_by_full_name(cls, full_name):
+        """
+        Repos with the given full name, most recently updated first. There
+        can be several, e.g. a renamed repo which hasn't been re-analysed yet
+        and a new repo created under its old name.
+        """
+        return cls.objects.filter(full_name=full_name).order_by(
+            "-updated_at", "provider", "provider_repo_id"
+        )
+
+    @staticmethod
+    def get_analysis_hash(repo_analysis):
+        canonical = json.dumps(
+            repo_analysis, sort_keys=True, separators=(",", ":")
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    @classmethod
+    def upsert_analyses(cls, provider, analyses):
+        """
+        Inserts or updates the analyses ({provider repo id -> analysis}) of
+        a provider's repos with one `INSERT ... ON CONFLICT DO UPDATE` per
+        `UPSERT_BATCH_SIZE` repos. Repos whose stored analysis is identical
+        aren't written at all. Returns the full names of the repos written.
+        """
+        table = cls._meta.db_table
+        rows = [
+            (
+                uuid.uuid4(),
+                provider,
+                provider_repo_id,
+                analysis["full_name"],
+                Json(analysis),
+                cls.get_analysis_hash(analysis),
+            )
+            for provider_repo_id, analysis in analyses.items()
+        ]
+
+        written = []
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), cls.UPSERT_BATCH_SIZE):
+                end = start + cls.UPSERT_BATCH_SIZE
+                batch = rows[start:end]
+                values = ", ".join(
+                    ["(%s, %s, %s, %s, %s, %s, now())"] * len(batch)
+                )
+                cursor.execute(
+                    f"""
+                    INSERT INTO {table} (
+                        id,
+                        provider,
+                        provider_repo_id,
+                        full_name,
+                        repo_analysis,
+                        analysis_hash,
+                        updated_at
+                    )
+                    VALUES {values}
+                    ON CONFLICT (provider, provider_repo_id) DO UPDATE SET
+                        full_name = EXCLUDED.full_name,
+                        repo_analysis = EXCLUDED.repo_analysis,
+                        analysis_hash = EXCLUDED.analysis_hash,
+                        updated_at = EXCLUDED.updated_at
+                    WHERE {table}.analysis_hash <> EXCLUDED.analysis_hash
+                    RETURNING full_name
+                    """,
+                    [value for row in batch for value in row],
+                )
+                written.extend(full_name for full_name, in cursor.fetchall())
 
-    # For speeding up queries by full_name, put an index on the full_name field
+        return written
 
 
 class Notification(models.Model):
@@ -244,16 +401,468 @@ def default_aggregated_analysis():
     return {"libs": {}, "tech": {}, "tags": {}}
 
 
+TECH_ANALYSIS_KINDS = ("libs", "tech", "tags")
+
+
+def apply_repo_to_aggregate(aggregated_analysis, repo, sign=1):
+    """
+    Adds (sign=1) or subtracts (sign=-1) the stats of a single tech analysis
+    repo to/from an aggregate in place. Categories left without insertions
+    and deletions are dropped, so the result doesn't depend on the order in
+    which repos were added and removed.
+    """
+    for kind in TECH_ANALYSIS_KINDS:
+        aggregate = aggregated_analysis[kind]
+        for specific_cat, stats in repo[kind].items():
+            totals = aggregate.setdefault(
+                specific_cat, {"insertions": 0, "deletions": 0}
+            )
+            totals["insertions"] += sign * stats["insertions"]
+            totals["deletions"] += sign * stats["deletions"]
+
+            if not totals["insertions"] and not totals["deletions"]:
+                del aggregate[specific_cat]
+
+
+def build_aggregated_analysis(repos):
+    aggregated_analysis = default_aggregated_analysis()
+    for repo in repos.values():
+        apply_repo_to_aggregate(aggregated_analysis, repo)
+
+    return aggregated_analysis
+
+
 class TechAnalysis(models.Model):
-    """Tech analysis for user"""
+    """
+    Tech analysis for user
+
+    `aggregated_analysis` sums up the stats of all `repos`. It is rebuilt
+    from scratch on save. `update_repos` changes repos without a save and
+    applies just the changed repos' deltas to it.
+    """
 
     user = models.OneToOneField(
         "users.User", on_delete=models.CASCADE, related_name="tech_analysis"
     )
     repos = JSONField(default=dict)
     aggregated_analysis = JSONField(default=default_aggregated_analysis)
+    # The libs/tech/tags of `aggregated_analysis` have expression GIN indexes
+    # (see migration 0013), use `filter_by_category` to query them
+
+    @classmethod
+    def filter_by_category(cls, kind, category):
+        """
+        Tech analyses whose aggregate includes a lib/tech/tag. A containment
+        query on `aggregated_analysis -> kind`, served by its GIN index.
+        """
+        if kind not in TECH_ANALYSIS_KINDS:
+            # Would be interpolated into the SQL by the key transform
+            raise ValueError(f"Unknown tech analysis kind {kind}")
+
+        return cls.objects.filter(
+            **{f"aggregated_analysis__{kind}__contains": {category: {}}}
+        )
+
+    @classmethod
+    def update_repos(cls, user_id, repos=None, removed_repos=()):
+        """
+        Atomically adds/replaces `repos` ({repo full name -> repo}) and
+        removes `removed_repos` of a user's tech analysis, creating it if
+        needed.
+
+        The row is locked while only the affected repos' old stats are read
+        to compute the aggregate delta, and the repos are merged into the
+        stored document in the database, so concurrent updates for the same
+        user don't overwrite each other. Doesn't send `post_save`.
+        """
+        repos = repos or {}
+        removed_repos = list(removed_repos)
+        table = cls._meta.db_table
+
+        old_repos_sql = RawSQL(
+            f"""
+            SELECT jsonb_object_agg(key, value)
+            FROM jsonb_each({table}.repos)
+            WHERE key = ANY(%s)
+            """,
+            [list(repos) + removed_repos],
+            output_field=JSONField(),
+        )
+        merged_repos_sql = RawSQL(
+            f"({table}.repos - %s::text[]) || %s::jsonb",
+            [removed_repos, Json(repos)],
+        )
+
+        with transaction.atomic():
+            cls.objects.get_or_create(user_id=user_id)
+            tech_analysis_id, aggregated_analysis, old_repos = (
+                cls.objects.select_for_update()
+                .filter(user_id=user_id)
+                .annotate(old_repos=old_repos_sql)
+                .values_list("id", "aggregated_analysis", "old_repos")
+                .get()
+            )
+
+            for old_repo in (old_repos or {}).values():
+                apply_repo_to_aggregate(aggregated_analysis, old_repo, -1)
+            for repo in repos.values():
+                apply_repo_to_aggregate(aggregated_analysis, repo)
+
+            cls.objects.filter(id=tech_analysis_id).update(
+                repos=merged_repos_sql,
+                aggregated_analysis=aggregated_analysis,
+            )
+            TechStackFact.replace_repos(
+                user_id, list(repos) + removed_repos, repos
+            )
+
+    def rebuild_aggregated_analysis(self):
+        self.aggregated_analysis = build_aggregated_analysis(self.repos)
+
+
+class TechStackFact(models.Model):
+    """
+    The stats of one lib/tech/tag of one repo of a user's tech analysis.
+
+    Kept in sync with `TechAnalysis.repos`, so per category questions (e.g.
+    top users of `js.vue`) are index scans instead of parsing every analysis
+    document.
+    """
+
+    KIND_CHOICES = [(kind, kind) for kind in TECH_ANALYSIS_KINDS]
+
+    user = models.ForeignKey(
+        "users.User",
+        on_delete=models.CASCADE,
+        related_name="tech_stack_facts",
+    )
+    repo_full_name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=4, choices=KIND_CHOICES)
+    category = models.CharField(max_length=255)
+    insertions = models.BigIntegerField()
+    deletions = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ("user", "repo_full_name", "kind", "category")
+        indexes = [
+            # Covers the per category aggregates (index only scans)
+            models.Index(
+                fields=["kind", "category", "user", "insertions", "deletions"]
+            ),
+        ]
+
+    @classmethod
+    def build_facts(cls, user_id, repos):
+        return [
+            cls(
+                user_id=user_id,
+                repo_full_name=repo_full_name,
+                kind=kind,
+                category=category,
+                insertions=stats["insertions"],
+                deletions=stats["deletions"],
+            )
+            for repo_full_name, repo in repos.items()
+            for kind in TECH_ANALYSIS_KINDS
+            for category, stats in repo[kind].items()
+        ]
+
+    @classmethod
+    def replace_repos(cls, user_id, repo_full_names, repos):
+        """
+        Replaces the facts of the given repos of a user with those of `repos`
+        ({repo full name -> repo}, may lack removed repos)
+        """
+        old_facts = cls.objects.filter(
+            user_id=user_id, repo_full_name__in=repo_full_names
+        )
+        cls._replace_facts(old_facts, cls.build_facts(user_id, repos))
+
+    @classmethod
+    def rebuild_user(cls, user_id, repos, refresh_leaderboard=True):
+        cls._replace_facts(
+            cls.objects.filter(user_id=user_id),
+            cls.build_facts(user_id, repos),
+            refresh_leaderboard,
+        )
+
+    @classmethod
+    def get_categories(cls, queryset):
+        """The distinct (kind, category) pairs of the facts in `queryset`"""
+        return set(queryset.values_list("kind", "category").distinct())
+
+    @classmethod
+    def get_top_users(cls, kind, category, limit=10, min_insertions=None):
+        """
+        Users with the most insertions in a lib/tech/tag, as dicts of
+        user_id, username, insertions, deletions and repos (count)
+        """
+        users = (
+            cls.objects.filter(kind=kind, category=category)
+            .values("user_id")
+            .annotate(
+                insertions=models.Sum("insertions"),
+                deletions=models.Sum("deletions"),
+                # Rows are unique per repo. Counting an indexed column keeps
+                # the scan index only
+                repos=models.Count("user"),
+            )
+        )
+        if min_insertions is not None:
+            users = users.filter(insertions__gte=min_insertions)
+        top_users = list(users.order_by("-insertions", "user_id")[:limit])
+
+        usernames = dict(
+            get_user_model()
+            .objects.filter(id__in=[user["user_id"] for user in top_users])
+            .values_list("id", "username")
+        )
+        for user in top_users:
+            user["username"] = usernames.get(user["user_id"])
+
+        return top_users
+
+    @classmethod
+    def _replace_facts(cls, old_facts, new_facts, refresh_leaderboard=True):
+        categories = cls.get_categories(old_facts)
+        old_facts.delete()
+        cls.objects.bulk_create(new_facts)
+
+        if refresh_leaderboard:
+            categories.update((fact.kind, fact.category) for fact in new_facts)
+            TechLeaderboardEntry.schedule_refresh(categories)
+
+
+class TechLeaderboardEntry(models.Model):
+    """
+    The cross-user stats of one lib/tech/tag, materialized from
+    `TechStackFact`.
+
+    Entries of the categories touched by tech analysis writes are refreshed
+    in the background after they commit (`TECH_LEADERBOARD_INCREMENTAL`), and
+    the whole table by the `refresh_tech_leaderboard` command.
+    """
+
+    KIND_CHOICES = TechStackFact.KIND_CHOICES
+
+    kind = models.CharField(max_length=4, choices=KIND_CHOICES)
+    category = models.CharField(max_length=255)
+    insertions = models.BigIntegerField()
+    deletions = models.BigIntegerField()
+    users = models.PositiveIntegerField()
+    # [{user_id, insertions, deletions, repos}], most insertions first
+    top_users = JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("kind", "category")
+        indexes = [
+            models.Index(
+                fields=["kind", "-insertions"],
+                name="profiles_tl_kind_insertions",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}: {self.category}"
+
+    @classmethod
+    def refresh(cls, categories=None):
+        """
+        Recomputes the entries of the given (kind, category) pairs from the
+        tech stack facts, or all entries if `categories` is None. Categories
+        without facts lose their entry.
+        """
+        if categories is not None:
+            categories = list(categories)
+            if not categories:
+                return
+        facts_table = TechStackFact._meta.db_table
+        table = cls._meta.db_table
+
+        if categories is None:
+            where, params = "", []
+        else:
+            where = """
+                WHERE (kind, category) IN (
+                    SELECT * FROM unnest(%s::text[], %s::text[])
+                )
+            """
+            params = [
+                [kind for kind, _ in categories],
+                [category for _, category in categories],
+            ]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Refreshes run one at a time, so each one computes the entries
+            # from facts committed no earlier than those of the previous one
+            # and a slower refresh can't overwrite a newer one
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(%s)", [TECH_LEADERBOARD_LOCK_ID]
+            )
+            cursor.execute(f"DELETE FROM {table} {where}", params)
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (
+                    kind, category, insertions, deletions, users, top_users,
+                    updated_at
+                )
+                SELECT
+                    kind,
+                    category,
+                    SUM(insertions),
+                    SUM(deletions),
+                    COUNT(*),
+                    COALESCE(
+                        jsonb_agg(
+                            jsonb_build_object(
+                                'user_id', user_id,
+                                'insertions', insertions,
+                                'deletions', deletions,
+                                'repos', repos
+                            )
+                            ORDER BY insertions DESC, user_id
+                        ) FILTER (WHERE rank <= %s),
+                        '[]'
+                    ),
+                    now()
+                FROM (
+                    SELECT
+                        *,
+                        row_number() OVER (
+                            PARTITION BY kind, category
+                            ORDER BY insertions DESC, user_id
+                        ) AS rank
+                    FROM (
+                        SELECT
+                            kind,
+                            category,
+                            user_id,
+                            SUM(insertions) AS insertions,
+                            SUM(deletions) AS deletions,
+                            COUNT(*) AS repos
+                        FROM {facts_table}
+                        {where}
+                        GROUP BY kind, category, user_id
+                    ) AS user_totals
+                ) AS ranked_users
+                GROUP BY kind, category
+                """,
+                [TECH_LEADERBOARD_TOP_USERS] + params,
+            )
+
+    @classmethod
+    def schedule_refresh(cls, categories):
+        """
+        Queues the entries of `categories` for a background refresh once the
+        transaction commits (see `TechLeaderboardRefresher`)
+        """
+        if not TECH_LEADERBOARD_INCREMENTAL or not categories:
+            return
+
+        categories = set(categories)
+        transaction.on_commit(
+            lambda: tech_leaderboard_refresher.schedule(categories)
+        )
+
+    @classmethod
+    def get_leaderboard(cls, kind, limit=20):
+        """
+        The `limit` categories of a kind with the most insertions, as dicts of
+        the entry fields whose top users also have their username. Cached for
+        `TECH_LEADERBOARD_CACHE_TIMEOUT` seconds.
+        """
+        key = f"profiles:tech_leaderboard:{kind}:{limit}"
+        leaderboard = cache.get(key)
+        if leaderboard is not None:
+            return leaderboard
+
+        leaderboard = list(
+            cls.objects.filter(kind=kind)
+            .order_by("-insertions", "category")
+            .values(
+                "kind",
+                "category",
+                "insertions",
+                "deletions",
+                "users",
+                "top_users",
+                "updated_at",
+            )[:limit]
+        )
+
+        user_ids = {
+            user["user_id"]
+            for entry in leaderboard
+            for user in entry["top_users"]
+        }
+        usernames = {
+            str(user_id): username
+            for user_id, username in get_user_model()
+            .objects.filter(id__in=user_ids)
+            .values_list("id", "username")
+        }
+        for entry in leaderboard:
+            for user in entry["top_users"]:
+                user["username"] = usernames.get(user["user_id"])
+
+        cache.set(key, leaderboard, TECH_LEADERBOARD_CACHE_TIMEOUT)
+        return leaderboard
+
+
+class TechLeaderboardRefresher:
+    """
+    Refreshes the leaderboard entries touched by tech analysis writes on a
+    daemon thread, every `interval` seconds.
+
+    A refresh re-aggregates every fact of its categories across all users, so
+    writes only queue their categories. The categories queued during an
+    interval are refreshed together, and popular categories once per
+    interval however many writes touch them. Queued categories are lost if
+    the process exits, the scheduled `refresh_tech_leaderboard` catches up.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, categories):
+        with self._lock:
+            self._pending.update(categories)
 
-    # NOTE: If queries are slow, check out using GIN index for jsonb fields
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="tech-leaderboard-refresher"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+
+    # helpers
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+
+            with self._lock:
+                categories, self._pending = self._pending, set()
+            if not categories:
+                continue
+
+            close_old_connections()
+            try:
+                TechLeaderboardEntry.refresh(categories)
+            except Exception:
+                logger.exception("Couldn't refresh the tech leaderboard")
+                # Retried with the next interval's categories
+                with self._lock:
+                    self._pending.update(categories)
+
+
+tech_leaderboard_refresher = TechLeaderboardRefresher(
+    TECH_LEADERBOARD_REFRESH_INTERVAL
+)
 
 
 # Signals
@@ -261,24 +870,26 @@ class TechAnalysis(models.Model):
 
 @receiver(pre_save, sender=TechAnalysis)
 def add_aggregated_analysis(sender, instance, **kwargs):
-    aggregated_analysis = {"libs": {}, "tech": {}, "tags": {}}
-
-    def get_initial_stats_unit():
-        return {"insertions": 0, "deletions": 0}
-
-    for repo_name, repo in instance.repos.items():
-        for libs_tech_or_tags in {"libs", "tech", "tags"}:
-            for (specific_cat, stats) in repo[libs_tech_or_tags].items():
-                if specific_cat not in aggregated_analysis[libs_tech_or_tags]:
-                    aggregated_analysis[libs_tech_or_tags][
-                        specific_cat
-                    ] = get_initial_stats_unit()
-
-                aggregated_analysis[libs_tech_or_tags][specific_cat][
-                    "insertions"
-                ] += stats["insertions"]
-                aggregated_analysis[libs_tech_or_tags][specific_cat][
-                    "deletions"
-                ] += stats["deletions"]
-
-    instance.aggregated_analysis = aggregated_analysis
+    instance.rebuild_aggregated_analysis()
+
+
+@receiver(post_save, sender=TechAnalysis)
+def rebuild_tech_stack_facts(sender, instance, **kwargs):
+    # `TechAnalysis.update_repos` syncs the changed repos' facts itself
+    TechStackFact.rebuild_user(instance.user_id, instance.repos)
+
+
+@receiver(pre_delete, sender=TechAnalysis)
+def refresh_deleted_tech_leaderboard_entries(sender, instance, **kwargs):
+    # Before the facts are gone, also when they are cascade deleted along
+    # with the user
+    TechLeaderboardEntry.schedule_refresh(
+        TechStackFact.get_categories(
+            TechStackFact.objects.filter(user_id=instance.user_id)
+        )
+    )
+
+
+@receiver(post_delete, sender=TechAnalysis)
+def delete_tech_stack_facts(sender, instance, **kwargs):
+    TechStackFact.objects.filter(user_id=instance.user_id).delete()
@@ -19,6 +19,10 @@ from apps.profiles.models import (
     ProfileAnalysis,
     StackOverflowProfile,
     ContactInfo,
+    TECH_ANALYSIS_KINDS,
+    TechAnalysis,
+    TechLeaderboardEntry,
+    TechStackFact,
 )
 from apps.base.schema import GenericResultMutation
 from apps.base.utils import (
@@ -37,6 +41,9 @@ STACK_OVERFLOW_CLIENT_ID = settings.STACK_OVERFLOW_CLIENT_ID
 STACK_OVERFLOW_CLIENT_SECRET = settings.STACK_OVERFLOW_CLIENT_SECRET
 STACK_OVERFLOW_REDIRECT_URI = settings.STACK_OVERFLOW_REDIRECT_URI
 
+MAX_TOP_TECH_STACK_USERS = 100
+MAX_TECH_LEADERBOARD_ENTRIES = 100
+
 
 logger = logging.getLogger(__name__)
 
@@ -87,9 +94,49 @@ class ContactInfoType(DjangoObjectType):
         model = ContactInfo
 
 
+class TechStackUserType(graphene.ObjectType):
+    user_id = graphene.UUID(required=True)
+    username = graphene.String()
+    # Sums over repos, which can exceed GraphQL's 32 bit Int
+    insertions = graphene.Float(required=True)
+    deletions = graphene.Float(required=True)
+    repos = graphene.Int(required=True)
+
+
+class TechLeaderboardEntryType(graphene.ObjectType):
+    kind = graphene.String(required=True)
+    category = graphene.String(required=True)
+    # Like `TechStackUserType`, floats as totals can exceed a 32 bit Int
+    insertions = graphene.Float(required=True)
+    deletions = graphene.Float(required=True)
+    users = graphene.Int(required=True)
+    top_users = graphene.List(TechStackUserType, required=True)
+    updated_at = graphene.DateTime(required=True)
+
+    def resolve_top_users(self, info):
+        return [TechStackUserType(**user) for user in self.top_users]
+
+
 class Query(graphene.ObjectType):
     profile = graphene.Field(ProfileType, id=graphene.Int(required=True))
 
+    top_tech_stack_users = graphene.List(
+        TechStackUserType,
+        kind=graphene.String(required=True),
+        category=graphene.String(required=True),
+        limit=graphene.Int(default_value=10),
+        min_insertions=graphene.Int(),
+    )
+    tech_leaderboard = graphene.List(
+        TechLeaderboardEntryType,
+        kind=graphene.String(required=True),
+        limit=graphene.Int(default_value=20),
+    )
+    tech_category_users_count = graphene.Int(
+        kind=graphene.String(required=True),
+        category=graphene.String(required=True),
+    )
+
     notification = graphene.Field(
         NotificationType, id=graphene.Int(required=True)
     )
@@ -117,6 +164,58 @@ class Query(graphene.ObjectType):
     def resolve_profile(self, info, **kwargs):
         return BaseProfileModel.objects.get(id=kwargs.get("id"))
 
+    @staff_member_required
+    def resolve_top_tech_stack_users(
+        self, info, kind, category, limit, min_insertions=None
+    ):
+        """Users with the most insertions in a lib, tech or tag"""
+        if kind not in TECH_ANALYSIS_KINDS:
+            raise GraphQLError(
+                f"kind must be one of {', '.join(TECH_ANALYSIS_KINDS)}"
+            )
+        if not 0 < limit <= MAX_TOP_TECH_STACK_USERS:
+            raise GraphQLError(
+                f"limit must be between 1 and {MAX_TOP_TECH_STACK_USERS}"
+            )
+
+        return [
+            TechStackUserType(**user)
+            for user in TechStackFact.get_top_users(
+                kind, category, limit, min_insertions
+            )
+        ]
+
+    @staff_member_required
+    def resolve_tech_leaderboard(self, info, kind, limit):
+        """The libs, techs or tags with the most insertions across users"""
+        if kind not in TECH_ANALYSIS_KINDS:
+            raise GraphQLError(
+                f"kind must be one of {', '.join(TECH_ANALYSIS_KINDS)}"
+            )
+        if not 0 < limit <= MAX_TECH_LEADERBOARD_ENTRIES:
+            raise GraphQLError(
+                f"limit must be between 1 and {MAX_TECH_LEADERBOARD_ENTRIES}"
+            )
+
+        return [
+            TechLeaderboardEntryType(**entry)
+            for entry in TechLeaderboardEntry.get_leaderboard(kind, limit)
+        ]
+
+    @staff_member_required
+    def resolve_tech_category_users_count(self, info, kind, category):
+        """
+        Users whose tech analysis currently uses a lib, tech or tag. Read
+        from the analyses, unlike the periodically refreshed leaderboard.
+        """
+        if kind not in TECH_ANALYSIS_KINDS:
+            raise GraphQLError(
+                f"kind must be one of {', '.join(TECH_ANALYSIS_KINDS)}"
+            )
+
+        # Served by the GIN index of the kind's aggregate
+        return TechAnalysis.filter_by_category(kind, category).count()
+
     @login_required
     def resolve_outsider_messages(
         self, info, page, on_each_page, order_by, **filters
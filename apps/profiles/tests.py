@@ -1,3 +1,23 @@
-from django.test import TestCase  # noqa: F401
+from django.db import connection
+from django.test import TestCase
 
-# Create your tests here.
+from apps.profiles.models import TECH_ANALYSIS_KINDS, TechAnalysis
+
+
+class FilterByCategoryTests(TestCase):
+    def test_uses_aggregate_gin_indexes(self):
+        with connection.cursor() as cursor:
+            # Tiny test tables would be scanned otherwise. Reset at the end of
+            # the test's transaction
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+        for kind in TECH_ANALYSIS_KINDS:
+            with self.subTest(kind=kind):
+                plan = TechAnalysis.filter_by_category(
+                    kind, "js.vue"
+                ).explain()
+                self.assertIn(f"profiles_techanalysis_{kind}_gin", plan)
+
+    def test_rejects_unknown_kinds(self):
+        with self.assertRaises(ValueError):
+            TechAnalysis.filter_by_category("langs", "python")
@@ -1,5 +1,6 @@
 import json
 import logging
+import threading
 
 import boto3
 import botocore
@@ -25,6 +26,9 @@ LAMBDA_INITIAL_ANALYSIS_FUNCTION = (
 )
 LAMBDA_INVOCATION_SOURCE = settings.AWS_LAMBDA_INVOCATION_SOURCE
 
+# Per thread boto3 sessions, see `get_dynamodb_resource`
+_boto3_local = threading.local()
+
 GITHUB_SUCCESS_TEMPLATE_PATH = "profiles/github_success.html"
 GITHUB_FAIL_TEMPLATE_PATH = "profiles/github_fail.html"
 
@@ -77,12 +81,26 @@ def dynamodb_create_or_update_profile(profile):
     )
 
 
+def get_dynamodb_resource():
+    """
+    The calling thread's DynamoDB resource. boto3's default session isn't
+    thread safe and the REST API fetches from several threads, so every
+    thread gets its own session.
+    """
+    resource = getattr(_boto3_local, "dynamodb", None)
+    if resource is None:
+        resource = boto3.session.Session().resource("dynamodb")
+        _boto3_local.dynamodb = resource
+
+    return resource
+
+
 def dynamodb_get_profile(user_id):
     """
     Uses the DynamoDB GetItem API to get the profile data as per the "profiles"
     table in high level python compatible format
     """
-    ddb = boto3.resource("dynamodb")
+    ddb = get_dynamodb_resource()
 
     table = ddb.Table(DDB_PROFILES_TABLE)
     response = table.get_item(Key={"user_id": str(user_id)})
@@ -159,7 +177,7 @@ def dynamodb_get_profile_analysis(user_id, **kwargs):
     """
     Get an item form the PROFILE_ANALYSIS table given the user's id
     """
-    ddb = boto3.resource("dynamodb")
+    ddb = get_dynamodb_resource()
 
     table = ddb.Table(DDB_PROFILE_ANALYSIS_TABLE)
     response = table.get_item(Key={"uuid": str(user_id)}, **kwargs)
@@ -170,7 +188,7 @@ def dynamodb_get_repo_analysis(repo_full_name, **kwargs):
     """
     Get an item from the repo analysis table given the repo_full_name
     """
-    ddb = boto3.resource("dynamodb")
+    ddb = get_dynamodb_resource()
 
     table = ddb.Table(DDB_REPO_ANALYSIS_TABLE)
     response = table.get_item(Key={"full_name": repo_full_name}, **kwargs)
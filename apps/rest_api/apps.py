@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class RestApiConfig(AppConfig):
-    name = "rest_api"
+    name = "apps.rest_api"
+    verbose_name = "REST API"
+
+    def ready(self):
+        import apps.rest_api.signals  # noqa: F401
@@ -0,0 +1,138 @@
+"""
+Caching of portfolio data served by the REST API.
+
+Entries are keyed per portfolio user and data version. The receivers in
+`apps.rest_api.signals` delete them and bump the version whenever the
+underlying rows change. Builders read the version before building, so a
+build racing with an invalidation caches its stale result under a key which
+is never read again. The timeout only bounds how long stale data can survive
+a missed invalidation.
+"""
+import typing
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+PORTFOLIO_CACHE_TIMEOUT = settings.PORTFOLIO_CACHE_TIMEOUT
+PORTFOLIO_USER_CACHE_TIMEOUT = settings.PORTFOLIO_USER_CACHE_TIMEOUT
+PORTFOLIO_USER_NEGATIVE_CACHE_TIMEOUT = (
+    settings.PORTFOLIO_USER_NEGATIVE_CACHE_TIMEOUT
+)
+
+# Cached in place of a PortfolioUser for ids without a user
+MISSING_USER = "missing"
+
+USER_INFO = "user_info"
+USER_SOCIALS = "user_socials"
+SELECTED_REPOS = "selected_repos"
+
+PORTFOLIO_CACHE_NAMES = [USER_INFO, USER_SOCIALS, SELECTED_REPOS]
+
+
+class PortfolioUser(typing.NamedTuple):
+    """The columns of a User needed to serve their portfolio"""
+
+    id: uuid.UUID
+    username: str
+    first_name: str
+    last_name: str
+    tagline: str
+    social_links: dict
+
+
+def get_portfolio_user_cache_key(user_id, version):
+    return f"rest_api:portfolio_user:{user_id}:{version}"
+
+
+def get_portfolio_user(user_id):
+    """
+    Returns the `PortfolioUser` for `user_id` or None if there is no such
+    user. Both outcomes are cached, unknown ids for a shorter time, so that
+    repeated lookups (including floods of invalid ids) don't hit the database.
+    """
+    try:
+        user_id = uuid.UUID(str(user_id))
+    except ValueError:
+        return None
+
+    # Not created here, as most unknown ids never get a version
+    version = cache.get(get_portfolio_version_cache_key(user_id), "")
+    key = get_portfolio_user_cache_key(user_id, version)
+    portfolio_user = cache.get(key)
+
+    if portfolio_user is None:
+        row = (
+            get_user_model()
+            .objects.filter(id=user_id)
+            .values_list(*PortfolioUser._fields)
+            .first()
+        )
+        if row is None:
+            cache.set(key, MISSING_USER, PORTFOLIO_USER_NEGATIVE_CACHE_TIMEOUT)
+            return None
+
+        portfolio_user = PortfolioUser(*row)
+        cache.set(key, portfolio_user, PORTFOLIO_USER_CACHE_TIMEOUT)
+
+    return None if portfolio_user == MISSING_USER else portfolio_user
+
+
+def get_portfolio_cache_key(user_id, version, name):
+    return f"rest_api:portfolio:{user_id}:{version}:{name}"
+
+
+def get_or_build_portfolio_data(user_id, name, build):
+    """
+    Read-through cache for portfolio data. Returns the cached value for the
+    user and `name`, calling `build()` and caching its result on a miss.
+    """
+    version = get_portfolio_data_version(user_id)
+    key = get_portfolio_cache_key(user_id, version, name)
+
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, PORTFOLIO_CACHE_TIMEOUT)
+
+    return data
+
+
+def get_portfolio_version_cache_key(user_id):
+    return f"rest_api:portfolio:{user_id}:version"
+
+
+def get_portfolio_data_version(user_id):
+    """
+    Opaque version of a user's portfolio data, changed on every invalidation.
+    ETags are derived from it, so requests can be answered with 304 without
+    building the response.
+    """
+    key = get_portfolio_version_cache_key(user_id)
+
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+
+    return version
+
+
+def bump_portfolio_data_version(user_id):
+    cache.set(get_portfolio_version_cache_key(user_id), uuid.uuid4().hex, None)
+
+
+def invalidate_portfolio_cache(user_id):
+    """Deletes all cached portfolio data of a user and bumps its version"""
+    version = cache.get(get_portfolio_version_cache_key(user_id), "")
+    cache.delete_many(
+        [get_portfolio_user_cache_key(user_id, version)]
+        + [
+            get_portfolio_cache_key(user_id, version, name)
+            for name in PORTFOLIO_CACHE_NAMES
+        ]
+    )
+    # After the data, so that the new version is never served stale data
+    bump_portfolio_data_version(user_id)
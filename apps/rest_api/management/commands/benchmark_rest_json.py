@@ -0,0 +1,146 @@
+import gzip
+import random
+import string
+import time
+
+import brotli
+from django.core.management.base import BaseCommand
+
+from apps.rest_api.serialization import get_available_json_backends
+from apps.rest_api.utils import BROTLI_QUALITY
+
+LANGUAGES = ["JavaScript", "Python", "TypeScript", "Go", "Rust", "HTML"]
+TECH = ["javascript-web", "testing", "utils", "database", "devops", "ml"]
+
+
+def random_word(rnd, length=8):
+    return "".join(rnd.choices(string.ascii_lowercase, k=length))
+
+
+def build_repo_analysis(rnd, full_name):
+    """A repo entry shaped like the ones posted by the analysis Lambdas"""
+    return {
+        "full_name": full_name,
+        "description": " ".join(random_word(rnd) for _ in range(12)),
+        "primaryLanguage": rnd.choice(LANGUAGES),
+        "isPrivate": rnd.random() < 0.2,
+        "stargazers_count": rnd.randint(0, 50000),
+        "size": rnd.randint(10, 10 ** 6),
+        "created_at": "2019-05-04T12:11:10Z",
+        "pushed_at": "2020-08-01T09:08:07Z",
+        "languages": [
+            {"name": lang, "size": rnd.randint(100, 10 ** 6)}
+            for lang in rnd.sample(LANGUAGES, 3)
+        ],
+        "contributors": {
+            random_word(rnd): {
+                "commits": rnd.randint(1, 2000),
+                "avatar_url": "https://avatars.githubusercontent.com/u/"
+                f"{rnd.randint(1, 10 ** 7)}",
+            }
+            for _ in range(rnd.randint(5, 30))
+        },
+        "tech_stack": {
+            key: {
+                f"{random_word(rnd, 3)}.{random_word(rnd)}": {
+                    "insertions": rnd.randint(0, 10 ** 5),
+                    "deletions": rnd.randint(0, 10 ** 5),
+                }
+                for _ in range(rnd.randint(5, 40))
+            }
+            for key in ["libs", "tech", "tags"]
+        },
+        "tech": rnd.sample(TECH, 2),
+    }
+
+
+def build_profile_analysis(size, seed=0):
+    """A synthetic profile analysis of about `size` bytes of JSON"""
+    rnd = random.Random(seed)
+    json_backend = get_available_json_backends()["json"]
+
+    repos = {}
+    document = {
+        "user_profile": {
+            "login": random_word(rnd),
+            "bio": " ".join(random_word(rnd) for _ in range(20)),
+            "avatarUrl": "https://avatars.githubusercontent.com/u/1",
+        },
+        "repos": repos,
+        "selectedRepos": [],
+    }
+
+    estimated = len(json_backend.dumps(document))
+    while estimated < size:
+        full_name = f"{random_word(rnd)}/{random_word(rnd)}"
+        repos[full_name] = build_repo_analysis(rnd, full_name)
+        estimated += len(json_backend.dumps({full_name: repos[full_name]}))
+
+    document["selectedRepos"] = list(repos)[:6]
+    return document
+
+
+def timed(func, repeat):
+    """Best of `repeat` runs, in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the available JSON backends and response compression on "
+        "synthetic profile analysis documents"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=float,
+            nargs="+",
+            default=[1, 2, 5],
+            help="Document sizes in MB (default: 1 2 5)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Runs per measurement, the best is reported (default: 5)",
+        )
+
+    def handle(self, sizes, repeat, **options):
+        backends = get_available_json_backends()
+
+        for size in sizes:
+            document = build_profile_analysis(int(size * 2 ** 20))
+            self.stdout.write(f"{size:g}MB document:")
+
+            encoded = None
+            for name, backend in backends.items():
+                dumps_time, encoded = timed(
+                    lambda: backend.dumps(document), repeat
+                )
+                loads_time, _ = timed(lambda: backend.loads(encoded), repeat)
+                self.stdout.write(
+                    f"  {name:<8} dumps {dumps_time * 1000:8.1f}ms  "
+                    f"loads {loads_time * 1000:8.1f}ms  "
+                    f"({len(encoded) / 2 ** 20:.2f}MB)"
+                )
+
+            for encoding, compress in [
+                ("gzip", lambda: gzip.compress(encoded, compresslevel=6)),
+                (
+                    "br",
+                    lambda: brotli.compress(encoded, quality=BROTLI_QUALITY),
+                ),
+            ]:
+                compress_time, compressed = timed(compress, repeat)
+                self.stdout.write(
+                    f"  {encoding:<8} compress {compress_time * 1000:5.1f}ms  "
+                    f"ratio {len(compressed) / len(encoded):.3f}"
+                )
@@ -0,0 +1,96 @@
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.rest_api.snapshots import (
+    LOCK_DIR,
+    PORTFOLIO_SNAPSHOTS_ROOT,
+    RENDER_DIR_PREFIXES,
+    REPO_INDEX_DIR,
+    delete_portfolio_snapshot,
+    write_portfolio_snapshot,
+)
+
+# Render directories older than this were left by interrupted renders
+STALE_RENDER_AGE = 60 * 60
+
+
+def write_snapshot(user_id):
+    try:
+        return write_portfolio_snapshot(user_id)
+    finally:
+        # Every worker thread opens its own connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the portfolio snapshots of all (or the given) users in "
+        "parallel and removes snapshots of deleted users"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "user_ids", nargs="*", help="Only render these users' snapshots"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Snapshots rendered concurrently (default: 8)",
+        )
+
+    def handle(self, user_ids, workers, **options):
+        if not user_ids:
+            user_ids = [
+                str(user_id)
+                for user_id in get_user_model().objects.values_list(
+                    "id", flat=True
+                )
+            ]
+            self.remove_stale_snapshots(set(user_ids))
+
+        start = time.perf_counter()
+        written = failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(write_snapshot, user_id): user_id
+                for user_id in user_ids
+            }
+            for future in as_completed(futures):
+                try:
+                    written += future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {e!r}")
+
+        self.stdout.write(
+            f"Rendered {written} snapshots in "
+            f"{time.perf_counter() - start:.2f}s ({failed} failed)"
+        )
+
+    def remove_stale_snapshots(self, user_ids):
+        if not os.path.isdir(PORTFOLIO_SNAPSHOTS_ROOT):
+            return
+
+        for name in os.listdir(PORTFOLIO_SNAPSHOTS_ROOT):
+            if name in user_ids or name in (REPO_INDEX_DIR, LOCK_DIR):
+                continue
+
+            if name.startswith(RENDER_DIR_PREFIXES):
+                path = os.path.join(PORTFOLIO_SNAPSHOTS_ROOT, name)
+                try:
+                    age = time.time() - os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                # Others may still be in progress in another process
+                if age > STALE_RENDER_AGE:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+
+            delete_portfolio_snapshot(name)
@@ -0,0 +1,240 @@
+"""Builders for the portfolio data returned by the REST API"""
+from functools import partial
+
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields.jsonb import KeyTransform
+from django.db.models.expressions import RawSQL
+
+from apps.profiles.models import ContactInfo, Repo, TechAnalysis
+from apps.profiles.utils import (
+    dynamodb_get_profile_analysis,
+    dynamodb_get_repo_analysis,
+)
+from apps.rest_api.cache import (
+    SELECTED_REPOS,
+    USER_INFO,
+    USER_SOCIALS,
+    get_or_build_portfolio_data,
+)
+from apps.rest_api.utils import run_concurrently
+from apps.widgets.models import Widget
+
+
+def build_user_info(user):
+    """`user` is a `PortfolioUser` (see `apps.rest_api.cache`)"""
+    contact_info = (
+        ContactInfo.objects.filter(user_id=user.id)
+        .values("email", "phone", "address")
+        .first()
+    )
+
+    return {
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "tagline": user.tagline,
+        "username": user.username,
+        "contact_info": contact_info,
+    }
+
+
+def get_user_info(user):
+    return get_or_build_portfolio_data(
+        user.id, USER_INFO, lambda: build_user_info(user)
+    )
+
+
+def get_user_socials(user):
+    return get_or_build_portfolio_data(
+        user.id, USER_SOCIALS, lambda: user.social_links
+    )
+
+
+def build_selected_repos(user):
+    prof_an = dynamodb_get_profile_analysis(
+        user.id, AttributesToGet=["repos", "selectedRepos"]
+    )
+    repos = prof_an.get("repos", {})
+
+    result = []
+    for repo_full_name in prof_an.get("selectedRepos", []):
+        repo = repos.get(repo_full_name)
+        if repo is None:
+            # Selected repos can outlive the repos map after a re-analysis
+            continue
+
+        result.append(
+            {
+                "repo_name": repo_full_name.split("/", maxsplit=1)[1],
+                "repo_full_name": repo_full_name,
+                "description": repo["description"],
+                "external_url": f"https://github.com/{repo_full_name}",
+                "primary_language": repo["primaryLanguage"],
+                "visibility": "private"
+                if repo.get("isPrivate") is True
+                else "public",
+            }
+        )
+
+    return {"count": len(result), "repos": result}
+
+
+def get_selected_repos(user):
+    return get_or_build_portfolio_data(
+        user.id, SELECTED_REPOS, lambda: build_selected_repos(user)
+    )
+
+
+# Repo analysis attributes returned by the single repo endpoint
+SINGLE_REPO_ATTRIBUTES = [
+    "archived",
+    "commits",
+    "contributors",
+    "created_at",
+    "default_branch",
+    "description",
+    "full_name",
+    "homepage",
+    "html_url",
+    "languages",
+    "license",
+    "name",
+    "owner",
+    "owner_avatar",
+    "private",
+    "pushed_at",
+    "size",
+    "stargazers_count",
+]
+
+
+def get_stored_repo_analysis(repo_full_name):
+    """
+    Gets the `SINGLE_REPO_ATTRIBUTES` of a repo analysis from the `Repo`
+    table, projected in the database (index lookup on `full_name`, the most
+    recently updated repo wins if several have the name). Returns None for
+    repos which haven't been stored in Postgres.
+    """
+    # Annotations can't shadow model fields, hence the prefix
+    annotations = {
+        f"analysis_{attr}": KeyTransform(attr, "repo_analysis")
+        for attr in SINGLE_REPO_ATTRIBUTES
+    }
+    row = (
+        Repo.get_latest_by_full_name(repo_full_name)
+        .annotate(**annotations)
+        .values(*annotations.keys())
+        .first()
+    )
+    if row is not None:
+        return {
+            attr: row[f"analysis_{attr}"] for attr in SINGLE_REPO_ATTRIBUTES
+        }
+
+    return None
+
+
+def get_repo_analysis_hash(repo_full_name):
+    """
+    `Repo.analysis_hash` of the repo `get_stored_repo_analysis` returns,
+    empty for repos which are only in DynamoDB
+    """
+    return (
+        Repo.get_latest_by_full_name(repo_full_name)
+        .values_list("analysis_hash", flat=True)
+        .first()
+        or ""
+    )
+
+
+def get_repo_tech_stack(user, repo_full_name):
+    """A single repo's entry of the user's tech analysis, or None"""
+    # Not a KeyTransform, which interpolates the (client supplied) key
+    # into the SQL on this Django version
+    tech_stack = RawSQL(
+        f"{TechAnalysis._meta.db_table}.repos -> %s",
+        [repo_full_name],
+        output_field=JSONField(),
+    )
+    return (
+        TechAnalysis.objects.filter(user_id=user.id)
+        .annotate(tech_stack=tech_stack)
+        .values_list("tech_stack", flat=True)
+        .first()
+    )
+
+
+def get_single_repo(user, repo_full_name):
+    """
+    The repo analysis with the user's tech stack for it, or None if neither
+    Postgres nor the DynamoDB repo analysis table has the repo
+    """
+    repo = get_stored_repo_analysis(repo_full_name)
+    if repo is not None:
+        # Both index lookups on the request's connection
+        tech_stack = get_repo_tech_stack(user, repo_full_name)
+    else:
+        # The DynamoDB fallback is fetched while the tech stack is queried
+        (repo,), (tech_stack,) = run_concurrently(
+            [
+                partial(
+                    dynamodb_get_repo_analysis,
+                    repo_full_name,
+                    AttributesToGet=SINGLE_REPO_ATTRIBUTES,
+                )
+            ],
+            [partial(get_repo_tech_stack, user, repo_full_name)],
+        )
+
+    if repo is not None:
+        repo["tech_stack"] = tech_stack
+
+    return repo
+
+
+def get_widget_stats(user):
+    """Not cached, as counters change with every flush of the widget buffer"""
+    return (
+        Widget.objects.filter(user_id=user.id)
+        .values("clicks", "impressions")
+        .first()
+    )
+
+
+# Portfolio bundle field -> getter
+PORTFOLIO_BUNDLE_FIELDS = {
+    "user_info": get_user_info,
+    "user_socials": get_user_socials,
+    "selected_repos": get_selected_repos,
+    "widget": get_widget_stats,
+}
+DEFAULT_PORTFOLIO_BUNDLE_FIELDS = [
+    "user_info",
+    "user_socials",
+    "selected_repos",
+]
+# Bundle fields built from DynamoDB rather than the database
+REMOTE_PORTFOLIO_BUNDLE_FIELDS = {"selected_repos"}
+
+
+def get_portfolio_bundle(user, fields):
+    """DynamoDB fields are fetched while the database is queried"""
+    remote_fields = [
+        field for field in fields if field in REMOTE_PORTFOLIO_BUNDLE_FIELDS
+    ]
+    db_fields = [
+        field
+        for field in fields
+        if field not in REMOTE_PORTFOLIO_BUNDLE_FIELDS
+    ]
+
+    remote_results, db_results = run_concurrently(
+        [
+            partial(PORTFOLIO_BUNDLE_FIELDS[field], user)
+            for field in remote_fields
+        ],
+        [partial(PORTFOLIO_BUNDLE_FIELDS[field], user) for field in db_fields],
+    )
+
+    data = dict(zip(remote_fields, remote_results))
+    data.update(zip(db_fields, db_results))
+    return {field: data[field] for field in fields}
@@ -0,0 +1,92 @@
+"""
+JSON encoding/decoding of REST API payloads.
+
+Profile and repo analysis documents run into megabytes, so the backend is
+pluggable (`REST_API_JSON_BACKEND`). orjson is used when installed and falls
+back to the stdlib `json` module otherwise. Both encode whatever
+`DjangoJSONEncoder` can (e.g. the Decimals returned by DynamoDB).
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+REST_API_JSON_BACKEND = settings.REST_API_JSON_BACKEND
+
+
+class StdlibJsonBackend:
+    name = "json"
+
+    def dumps(self, data):
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonBackend:
+    name = "orjson"
+
+    def __init__(self):
+        self._default = DjangoJSONEncoder().default
+
+    def dumps(self, data):
+        # Non str keys are stringified, like the stdlib does
+        return orjson.dumps(
+            data, default=self._default, option=orjson.OPT_NON_STR_KEYS
+        )
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def get_available_json_backends():
+    backends = {"json": StdlibJsonBackend()}
+    if orjson is not None:
+        backends["orjson"] = OrjsonBackend()
+
+    return backends
+
+
+def get_json_backend(name):
+    backends = get_available_json_backends()
+    if name not in backends:
+        logger.warning(f"JSON backend {name} unavailable, using json")
+        return backends["json"]
+
+    return backends[name]
+
+
+json_backend = get_json_backend(REST_API_JSON_BACKEND)
+
+
+def json_dumps(data):
+    """Encodes `data` to (UTF-8) JSON bytes"""
+    return json_backend.dumps(data)
+
+
+def json_loads(data):
+    """Decodes JSON bytes or str. Raises ValueError for invalid JSON."""
+    return json_backend.loads(data)
+
+
+class FastJsonResponse(HttpResponse):
+    """`JsonResponse` encoded with the configured JSON backend"""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                "In order to allow non-dict objects to be serialized set the "
+                "safe parameter to False."
+            )
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=json_dumps(data), **kwargs)
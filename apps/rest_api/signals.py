@@ -0,0 +1,85 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.profiles.models import (
+    BaseProfileModel,
+    BitbucketProfile,
+    ContactInfo,
+    GithubProfile,
+    GitlabProfile,
+    TechAnalysis,
+)
+from apps.rest_api.cache import (
+    bump_portfolio_data_version,
+    invalidate_portfolio_cache,
+)
+from apps.rest_api.snapshots import (
+    discard_portfolio_snapshot,
+    snapshot_scheduler,
+)
+
+
+def portfolio_data_changed(user_id):
+    # After the commit, so that concurrent requests can't cache (or tag with
+    # the new version) data of the uncommitted transaction. The snapshot goes
+    # first, so that it's never served with the new version
+    def invalidate():
+        discard_portfolio_snapshot(user_id)
+        invalidate_portfolio_cache(user_id)
+
+    transaction.on_commit(invalidate)
+    snapshot_scheduler.schedule(user_id)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_portfolio(sender, instance, **kwargs):
+    portfolio_data_changed(instance.id)
+
+
+@receiver(post_save, sender=ContactInfo)
+@receiver(post_delete, sender=ContactInfo)
+def invalidate_contact_info_portfolio(sender, instance, **kwargs):
+    portfolio_data_changed(instance.user_id)
+
+
+# Profile analysis (and with it the selected repos) is saved by the
+# `github_profile_analysis` view and the `SelectRepos` mutation
+@receiver(post_save, sender=BaseProfileModel)
+@receiver(post_save, sender=GithubProfile)
+@receiver(post_save, sender=GitlabProfile)
+@receiver(post_save, sender=BitbucketProfile)
+@receiver(post_delete, sender=BaseProfileModel)
+def invalidate_profile_portfolio(sender, instance, **kwargs):
+    portfolio_data_changed(instance.user_id)
+
+
+def repo_data_changed(user_id):
+    """
+    For changes of a user's tech analysis or repo analyses. Also called by
+    views which update those without sending `post_save`.
+    """
+    # Both are only part of the single repo responses, which aren't cached
+    def invalidate():
+        discard_portfolio_snapshot(user_id)
+        bump_portfolio_data_version(user_id)
+
+    transaction.on_commit(invalidate)
+    snapshot_scheduler.schedule(user_id)
+
+
+def repos_changed(repo_full_names):
+    """
+    For changes of `Repo` rows, which are shared by every user showing the
+    repo, unlike the user's own data. Single repo ETags include the repo's
+    analysis hash, so only snapshots need to be invalidated.
+    """
+    snapshot_scheduler.schedule_repos(repo_full_names)
+
+
+@receiver(post_save, sender=TechAnalysis)
+@receiver(post_delete, sender=TechAnalysis)
+def tech_analysis_changed(sender, instance, **kwargs):
+    repo_data_changed(instance.user_id)
@@ -0,0 +1,410 @@
+"""
+Pre-rendered portfolio responses.
+
+When `PORTFOLIO_SNAPSHOTS` is on, every user's portfolio responses are
+rendered to JSON files after their data changes, and the REST views stream
+those files instead of querying Postgres/DynamoDB. Layout:
+
+    <PORTFOLIO_SNAPSHOTS_ROOT>/<user_id>/
+        user_info.json
+        user_socials.json
+        selected_repos.json
+        portfolio.json              (/portfolio/ with the default fields)
+        repos/<sha1 of full name>.json
+        <any of the above>.br/.gz   (pre-compressed, if large enough)
+        .repo_digests               (the sha1s of the repos above)
+
+Repos are shared by every user showing them, so an index of which users'
+snapshots include a repo is kept next to the snapshots:
+
+    <PORTFOLIO_SNAPSHOTS_ROOT>/.repos/<sha1 of full name>/<user_id>
+
+and is used to invalidate those users' snapshots when the repo changes.
+
+A user's directory is rendered next to the live one (".new-...") and swapped
+in, so views never see a partially written snapshot. Renders of a user are
+serialized by a lock file in `<PORTFOLIO_SNAPSHOTS_ROOT>/.locks/`, so an
+older render can't replace a newer one. Whenever a snapshot is missing the
+views fall back to building the response.
+"""
+import fcntl
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import brotli
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+
+from apps.rest_api import portfolio
+from apps.rest_api.cache import (
+    SELECTED_REPOS,
+    USER_INFO,
+    USER_SOCIALS,
+    get_portfolio_user,
+)
+from apps.rest_api.serialization import json_dumps
+from apps.rest_api.utils import (
+    REST_API_COMPRESSION_MIN_SIZE,
+    get_accepted_encoding,
+)
+
+logger = logging.getLogger(__name__)
+
+PORTFOLIO_SNAPSHOTS = settings.PORTFOLIO_SNAPSHOTS
+PORTFOLIO_SNAPSHOTS_ROOT = settings.PORTFOLIO_SNAPSHOTS_ROOT
+PORTFOLIO_SNAPSHOT_WORKERS = settings.PORTFOLIO_SNAPSHOT_WORKERS
+
+PORTFOLIO = "portfolio"
+REPOS_DIR = "repos"
+REPO_INDEX_DIR = ".repos"
+LOCK_DIR = ".locks"
+# Directories of renders in progress
+RENDER_DIR_PREFIXES = (".new-", ".old-")
+# Lists the digests of a snapshot's repos, which outlive invalidated files
+REPO_DIGESTS = ".repo_digests"
+# Content-Encoding -> suffix of the pre-compressed snapshot files
+COMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+# Slower than `BROTLI_QUALITY`, but snapshots are compressed once per change
+SNAPSHOT_BROTLI_QUALITY = 9
+
+
+def get_snapshot_dir(user_id):
+    return os.path.join(PORTFOLIO_SNAPSHOTS_ROOT, str(user_id))
+
+
+def get_repo_digest(repo_full_name):
+    # Repo names may contain characters which aren't safe in file names
+    return hashlib.sha1(repo_full_name.encode()).hexdigest()
+
+
+def get_repo_snapshot_name(repo_full_name):
+    return os.path.join(REPOS_DIR, get_repo_digest(repo_full_name))
+
+
+def get_repo_index_dir(repo_digest):
+    return os.path.join(PORTFOLIO_SNAPSHOTS_ROOT, REPO_INDEX_DIR, repo_digest)
+
+
+def get_snapshot_repo_digests(user_id):
+    """The digests of the repos indexed for a user's current snapshot"""
+    path = os.path.join(get_snapshot_dir(user_id), REPO_DIGESTS)
+    try:
+        with open(path) as f:
+            return set(f.read().split())
+    except FileNotFoundError:
+        return set()
+
+
+def index_snapshot_repos(user_id, repo_digests):
+    for repo_digest in repo_digests:
+        index_dir = get_repo_index_dir(repo_digest)
+        os.makedirs(index_dir, exist_ok=True)
+        open(os.path.join(index_dir, str(user_id)), "a").close()
+
+
+def unindex_snapshot_repos(user_id, repo_digests):
+    for repo_digest in repo_digests:
+        try:
+            os.remove(os.path.join(get_repo_index_dir(repo_digest), user_id))
+        except FileNotFoundError:
+            pass
+
+
+def invalidate_repo_snapshots(repo_full_names):
+    """
+    Deletes the repo snapshot files of the given repos from every user's
+    snapshot. Returns the ids of the affected users, whose snapshots should
+    be regenerated.
+    """
+    user_ids = set()
+    for repo_full_name in repo_full_names:
+        repo_digest = get_repo_digest(repo_full_name)
+        try:
+            repo_user_ids = os.listdir(get_repo_index_dir(repo_digest))
+        except FileNotFoundError:
+            continue
+
+        for user_id in repo_user_ids:
+            if not os.path.isdir(get_snapshot_dir(user_id)):
+                # Left behind by a snapshot removed without unindexing
+                unindex_snapshot_repos(user_id, [repo_digest])
+                continue
+
+            path = os.path.join(
+                get_snapshot_dir(user_id), REPOS_DIR, f"{repo_digest}.json"
+            )
+            # Compressed versions first, they are preferred by the views
+            for suffix in [*COMPRESSED_SUFFIXES.values(), ""]:
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+            user_ids.add(user_id)
+
+    return user_ids
+
+
+def build_portfolio_snapshot(user):
+    """
+    Returns {snapshot name -> response data} for a `PortfolioUser`, covering
+    every response a portfolio site makes for the user.
+    """
+    data = portfolio.get_portfolio_bundle(
+        user, [USER_INFO, USER_SOCIALS, SELECTED_REPOS]
+    )
+    data[PORTFOLIO] = {
+        field: data[field]
+        for field in portfolio.DEFAULT_PORTFOLIO_BUNDLE_FIELDS
+    }
+
+    repo_full_names = [
+        repo["repo_full_name"] for repo in data[SELECTED_REPOS]["repos"]
+    ]
+    # Database lookups on this thread's connection, see `run_concurrently`
+    for repo_full_name in repo_full_names:
+        single_repo = portfolio.get_single_repo(user, repo_full_name)
+        if single_repo is not None:
+            data[get_repo_snapshot_name(repo_full_name)] = single_repo
+
+    return data
+
+
+def write_snapshot_file(path, content):
+    """
+    Writes a snapshot file and, if it's large enough for responses to be
+    compressed, its brotli and gzip versions. Rendering is off the request
+    path, so both use their best compression.
+    """
+    with open(path, "wb") as f:
+        f.write(content)
+
+    if len(content) < REST_API_COMPRESSION_MIN_SIZE:
+        return
+
+    with open(path + COMPRESSED_SUFFIXES["br"], "wb") as f:
+        f.write(brotli.compress(content, quality=SNAPSHOT_BROTLI_QUALITY))
+    with open(path + COMPRESSED_SUFFIXES["gzip"], "wb") as f:
+        f.write(gzip.compress(content, compresslevel=9))
+
+
+@contextmanager
+def lock_portfolio_snapshot(user_id):
+    """Serializes the renders of a user's snapshot across processes"""
+    lock_dir = os.path.join(PORTFOLIO_SNAPSHOTS_ROOT, LOCK_DIR)
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, str(user_id)), "a") as lock_file:
+        # Released when the file is closed
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def write_portfolio_snapshot(user_id):
+    """
+    Renders the snapshot of a user, or deletes it if the user doesn't exist
+    (anymore). Returns False in the latter case.
+
+    The data is read once the user's lock is held, so the last render to run
+    also saw the latest data.
+    """
+    with lock_portfolio_snapshot(user_id):
+        return _write_portfolio_snapshot(user_id)
+
+
+def _write_portfolio_snapshot(user_id):
+    user = get_portfolio_user(user_id)
+    if user is None:
+        delete_portfolio_snapshot(user_id)
+        return False
+
+    data = build_portfolio_snapshot(user)
+    repo_digests = {
+        os.path.basename(name)
+        for name in data
+        if os.path.dirname(name) == REPOS_DIR
+    }
+    old_repo_digests = get_snapshot_repo_digests(user.id)
+
+    os.makedirs(PORTFOLIO_SNAPSHOTS_ROOT, exist_ok=True)
+    # Before the snapshot is served, so that changes of its repos reach it
+    index_snapshot_repos(user.id, repo_digests)
+    new_dir = tempfile.mkdtemp(prefix=".new-", dir=PORTFOLIO_SNAPSHOTS_ROOT)
+    try:
+        os.mkdir(os.path.join(new_dir, REPOS_DIR))
+        with open(os.path.join(new_dir, REPO_DIGESTS), "w") as f:
+            f.write("\n".join(sorted(repo_digests)))
+        for name, response_data in data.items():
+            write_snapshot_file(
+                os.path.join(new_dir, f"{name}.json"),
+                json_dumps(response_data),
+            )
+        os.chmod(new_dir, 0o755)
+
+        snapshot_dir = get_snapshot_dir(user.id)
+        old_dir = None
+        if os.path.isdir(snapshot_dir):
+            old_dir = tempfile.mkdtemp(
+                prefix=".old-", dir=PORTFOLIO_SNAPSHOTS_ROOT
+            )
+            os.replace(snapshot_dir, os.path.join(old_dir, "snapshot"))
+        os.replace(new_dir, snapshot_dir)
+    finally:
+        shutil.rmtree(new_dir, ignore_errors=True)
+
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+    unindex_snapshot_repos(str(user.id), old_repo_digests - repo_digests)
+
+    return True
+
+
+def delete_portfolio_snapshot(user_id):
+    repo_digests = get_snapshot_repo_digests(user_id)
+    shutil.rmtree(get_snapshot_dir(user_id), ignore_errors=True)
+    unindex_snapshot_repos(str(user_id), repo_digests)
+
+
+def discard_portfolio_snapshot(user_id):
+    """
+    Deletes a user's snapshot if snapshots are served, e.g. when the data it
+    was rendered from changed
+    """
+    if PORTFOLIO_SNAPSHOTS:
+        delete_portfolio_snapshot(user_id)
+
+
+def get_snapshot_version(user_id):
+    """
+    Identifies the snapshot directory currently swapped in for a user (empty
+    if there is none), so that ETags change whenever it is replaced
+    """
+    if not PORTFOLIO_SNAPSHOTS:
+        return ""
+
+    try:
+        stat = os.stat(get_snapshot_dir(user_id))
+    except FileNotFoundError:
+        return ""
+
+    return f"{stat.st_ino}:{stat.st_mtime_ns}:{stat.st_ctime_ns}"
+
+
+def get_snapshot_response(request, user_id, name):
+    """
+    Streams a snapshot file if snapshots are served and the file exists,
+    otherwise returns None. Files are compressed when rendered, so their
+    brotli/gzip version is streamed if the client accepts it.
+    """
+    if not PORTFOLIO_SNAPSHOTS:
+        return None
+
+    path = os.path.join(get_snapshot_dir(user_id), f"{name}.json")
+    encoding = get_accepted_encoding(request)
+    snapshot = None
+    if encoding is not None:
+        try:
+            snapshot = open(path + COMPRESSED_SUFFIXES[encoding], "rb")
+        except FileNotFoundError:
+            # Too small to be compressed (or gone)
+            encoding = None
+
+    if snapshot is None:
+        try:
+            snapshot = open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+    response = FileResponse(snapshot, content_type="application/json")
+    patch_vary_headers(response, ("Accept-Encoding",))
+    if encoding is not None:
+        response["Content-Encoding"] = encoding
+
+    return response
+
+
+class SnapshotScheduler:
+    """
+    Regenerates snapshots on a small thread pool, so requests saving
+    portfolio data don't wait for the rendering. A user is never queued or
+    rendered twice at the same time: changes arriving while their snapshot
+    is rendered mark it dirty, and it's rendered once more afterwards.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        # Users queued or being rendered
+        self._active = set()
+        # Active users whose data changed after their render started
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, user_id):
+        """Regenerates the snapshot of a user once the transaction commits"""
+        if PORTFOLIO_SNAPSHOTS:
+            transaction.on_commit(lambda: self._submit(str(user_id)))
+
+    def schedule_repos(self, repo_full_names):
+        """
+        Once the transaction commits, removes the given repos from every
+        snapshot including them and regenerates those snapshots
+        """
+        if PORTFOLIO_SNAPSHOTS and repo_full_names:
+            transaction.on_commit(
+                lambda: self._submit_repos(list(repo_full_names))
+            )
+
+    # helpers
+
+    def _submit_repos(self, repo_full_names):
+        for user_id in invalidate_repo_snapshots(repo_full_names):
+            self._submit(user_id)
+
+    def _submit(self, user_id):
+        with self._lock:
+            if user_id in self._active:
+                self._dirty.add(user_id)
+                return
+            self._active.add(user_id)
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="portfolio-snapshots",
+                )
+
+        self._executor.submit(self._regenerate, user_id)
+
+    def _regenerate(self, user_id):
+        try:
+            while True:
+                with self._lock:
+                    # Changes up to here are seen by this render
+                    self._dirty.discard(user_id)
+
+                try:
+                    write_portfolio_snapshot(user_id)
+                except Exception:
+                    logger.exception(
+                        f"Couldn't write portfolio snapshot {user_id}"
+                    )
+                    # A stale snapshot would be served until the next change
+                    delete_portfolio_snapshot(user_id)
+
+                with self._lock:
+                    if user_id not in self._dirty:
+                        self._active.discard(user_id)
+                        return
+        finally:
+            connection.close()
+
+
+snapshot_scheduler = SnapshotScheduler(PORTFOLIO_SNAPSHOT_WORKERS)
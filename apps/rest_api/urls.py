@@ -7,10 +7,12 @@ urlpatterns = [
     path("user_info/", views.get_user_info),
     path("user_socials/", views.get_user_socials),
     path("selected_repos/", views.get_selected_repos),
+    path("portfolio/", views.get_portfolio),
     path("single_repo/<str:repo_full_name_b64>/", views.get_single_repo),
     path(
         "tech_analysis/<uuid:user_id>/add_repo/", views.add_tech_analysis_repo
     ),
+    path("tech_analysis/bulk/", views.add_tech_analysis_repos_bulk),
     path(
         "profile_analysis/github/<uuid:user_id>/",
         views.github_profile_analysis,
@@ -18,4 +20,9 @@ urlpatterns = [
     path(
         "repo_analysis/github/<uuid:user_id>/", views.add_github_repo_analysis
     ),
+    path(
+        "repo_analysis/github/<uuid:user_id>/bulk/",
+        views.add_github_repo_analyses_bulk,
+    ),
+    path("widgets/<uuid:user_id>/beacon/", views.widget_beacon),
 ]
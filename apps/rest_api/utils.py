@@ -2,11 +2,19 @@ import base64
 import hashlib
 import logging
 import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
+import brotli
 from django.conf import settings
 from django.http import Http404, HttpResponseForbidden
-from django.contrib.auth import get_user_model
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from apps.profiles.models import TechStackFact
+from apps.rest_api.cache import get_portfolio_user
 
 
 logger = logging.getLogger("django-restapi")
@@ -14,6 +22,18 @@ logger = logging.getLogger("django-restapi")
 TECH_ANALYSIS_AUTH_HASH = settings.TECH_ANALYSIS_AUTH_HASH
 LAMBDA_AUTH_USERNAME = settings.LAMBDA_AUTH_USERNAME
 LAMBDA_AUTH_PASSWORD_HASH = settings.LAMBDA_AUTH_PASSWORD_HASH
+REST_API_COMPRESSION_MIN_SIZE = settings.REST_API_COMPRESSION_MIN_SIZE
+REST_API_BACKEND_WORKERS = settings.REST_API_BACKEND_WORKERS
+
+MAX_TECH_STACK_NAME_LENGTH = min(
+    TechStackFact._meta.get_field(name).max_length
+    for name in ["repo_full_name", "category"]
+)
+
+# Favours speed, responses are compressed on every request
+BROTLI_QUALITY = 4
+ACCEPTS_BROTLI = re.compile(r"\bbr\b")
+ACCEPTS_GZIP = re.compile(r"\bgzip\b")
 
 
 def get_repo_full_name_pattern():
@@ -60,10 +80,39 @@ def validate_tech_analysis_data(data):
     """
     assert set(data.keys()) == {"repo_full_name", "libs", "tech", "tags"}
     assert re.match(get_repo_full_name_pattern(), data["repo_full_name"])
+    # Stored in the (varchar) columns of `TechStackFact`
+    assert len(data["repo_full_name"]) <= MAX_TECH_STACK_NAME_LENGTH
     for key in ["libs", "tech", "tags"]:
         # passes for empty dicts too
-        for _, val in data[key].items():
+        for category, val in data[key].items():
+            assert len(category) <= MAX_TECH_STACK_NAME_LENGTH
             assert set(val.keys()) == {"insertions", "deletions"}
+            assert all(isinstance(count, int) for count in val.values())
+
+
+def validate_bulk_tech_analysis_data(data):
+    """
+    Data format (JSON):
+
+    {
+        "<user_id>": [
+            <repo as accepted by `validate_tech_analysis_data`>,
+            ...
+        ],
+        ...
+    }
+    """
+    assert isinstance(data, dict)
+    for user_id, repos in data.items():
+        try:
+            uuid.UUID(user_id)
+        except ValueError:
+            raise AssertionError(f"Invalid user id {user_id}")
+
+        assert isinstance(repos, list)
+        for repo in repos:
+            assert isinstance(repo, dict)
+            validate_tech_analysis_data(repo)
 
 
 def validate_profile_analysis_data(data):
@@ -105,6 +154,51 @@ def validate_profile_analysis_data(data):
         assert re.match(repo_full_name_pattern, repo_full_name)
 
 
+def validate_profile_analysis_patch_data(data):
+    """
+    Data Format (JSON):
+
+    {
+        "user_profile": {
+            "bio": str,  (null deletes the field)
+            ...
+        },
+        "repos": {
+            "<ownerName>/<repoName>": {  (null deletes the repo)
+                "description": str,
+                "full_name": str,
+                ...
+            }
+        },
+        "selectedRepos": [
+            "<ownerName>/<repoName>",
+            ...
+        ]
+    }
+
+    All keys are optional. Only the changed fragments are validated.
+    """
+    repo_full_name_pattern = get_repo_full_name_pattern()
+
+    assert isinstance(data, dict)
+    expected_keys = {"user_profile", "repos", "selectedRepos"}
+    for key in data:
+        assert key in expected_keys, f"Unexpected key {key}"
+
+    assert isinstance(data.get("user_profile", {}), dict)
+
+    repos = data.get("repos", {})
+    assert isinstance(repos, dict)
+    for repo_full_name, repo in repos.items():
+        assert re.match(repo_full_name_pattern, repo_full_name)
+        assert repo is None or isinstance(repo, dict)
+
+    selected_repos = data.get("selectedRepos", [])
+    assert isinstance(selected_repos, list)
+    for repo_full_name in selected_repos:
+        assert re.match(repo_full_name_pattern, repo_full_name)
+
+
 def validate_repo_analysis_data(data):
     """
     Data Format (JSON):
@@ -121,8 +215,10 @@ def validate_repo_analysis_data(data):
     repo_full_name_regex = get_repo_full_name_pattern()
 
     assert set(data.keys()) == {"id", "analysis"}
+    assert isinstance(data["id"], int)
     assert "full_name" in data["analysis"]
     assert re.match(repo_full_name_regex, data["analysis"]["full_name"])
+    assert len(data["analysis"]["full_name"]) <= 255
 
 
 def require_techanalysis_auth(view_func):
@@ -171,7 +267,7 @@ def require_lambda_auth(view_func):
 
 def dynamic_cors_middleware(get_response):
     USER_ID_HEADER_KEY = "X-API-KEY"
-    HOSTNAME_PATTERN = (
+    HOSTNAME_PATTERN = re.compile(
         r"^http://([^\.]*)\.localhost"
         if settings.ENV == "dev"
         else r"^https://([^\.]*)\.hyperlog\.dev"
@@ -184,31 +280,31 @@ def dynamic_cors_middleware(get_response):
         if origin is None:
             raise Http404()
 
-        reg_match = re.match(HOSTNAME_PATTERN, origin)
+        reg_match = HOSTNAME_PATTERN.match(origin)
         if settings.DEBUG is False and not reg_match:
             logger.warn(
                 f"Got invalid request from {origin}. "
-                f"Hostname pattern wrong. Meta dump: {request.META}"
+                f"Hostname pattern wrong. Path: {request.path}"
             )
             # 404 makes it a little bit harder for outsiders to understand the API  # noqa: E501
             raise Http404()
 
         subdomain_username = reg_match.group(1) if reg_match else None
 
-        UserModel = get_user_model()
         user_id = request.headers.get(USER_ID_HEADER_KEY)
+        portfolio_user = get_portfolio_user(user_id)
 
-        try:
-            portfolio_user = UserModel.objects.get(id=user_id)
-            if not settings.DEBUG:
-                assert portfolio_user.username == subdomain_username
-        except UserModel.DoesNotExist:
+        if portfolio_user is None:
             logger.warn(
-                f"Got invalid request from {origin}. Wrong Portfolio user id. "
-                f"Meta dump: {request.META}"
+                f"Got invalid request from {origin}. Wrong Portfolio user id "
+                f"{user_id}. Path: {request.path}"
             )
             raise Http404("User not found")
-        except AssertionError:
+
+        if (
+            not settings.DEBUG
+            and portfolio_user.username != subdomain_username
+        ):
             logger.warn(
                 f"Subdomain user ({subdomain_username}) and api-key user "
                 f"({portfolio_user.username}) do not match"
@@ -219,3 +315,103 @@ def dynamic_cors_middleware(get_response):
         return get_response(request, *args, **kwargs)
 
     return middleware
+
+
+def compress_response(view_func):
+    """
+    Compresses responses of at least `REST_API_COMPRESSION_MIN_SIZE` bytes
+    with brotli or gzip, whichever the client accepts (brotli preferred).
+    Like `GZipMiddleware`, ETags are made weak as the bytes differ per
+    encoding. Streamed responses aren't compressed, portfolio snapshots are
+    compressed when rendered instead (see `get_snapshot_response`).
+    """
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+
+        if response.has_header("Content-Encoding"):
+            # Already compressed, e.g. a pre-compressed snapshot
+            weaken_etag(response)
+            return response
+
+        if (
+            response.streaming
+            or len(response.content) < REST_API_COMPRESSION_MIN_SIZE
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        encoding = get_accepted_encoding(request)
+        if encoding == "br":
+            content = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif encoding == "gzip":
+            content = compress_string(response.content)
+        else:
+            return response
+
+        response.content = content
+        response["Content-Length"] = str(len(content))
+        response["Content-Encoding"] = encoding
+        weaken_etag(response)
+
+        return response
+
+    return wrapper
+
+
+def get_accepted_encoding(request):
+    """The preferred supported `Accept-Encoding` of a request, or None"""
+    accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    if ACCEPTS_BROTLI.search(accept_encoding):
+        return "br"
+    if ACCEPTS_GZIP.search(accept_encoding):
+        return "gzip"
+
+    return None
+
+
+def weaken_etag(response):
+    etag = response.get("ETag")
+    if etag and etag.startswith('"'):
+        response["ETag"] = "W/" + etag
+
+
+backend_executor = ThreadPoolExecutor(
+    max_workers=REST_API_BACKEND_WORKERS, thread_name_prefix="rest-api"
+)
+_worker_state = threading.local()
+
+
+def _run_backend_call(func):
+    _worker_state.in_worker = True
+    return func()
+
+
+def run_concurrently(remote_funcs, db_funcs=()):
+    """
+    Calls independent backend fetches concurrently, so a request waits for
+    the slowest fetch instead of their sum. `remote_funcs` (DynamoDB/boto3
+    fetches, which must not use the database) run on a bounded thread pool
+    while `db_funcs` run one after the other on the calling thread, using its
+    database connection: pool threads would each open (and close) their own
+    connection, which costs more than the queries. Returns the results of
+    both, in order. Exceptions are re-raised.
+
+    Calls made from within a pool thread run sequentially, as waiting on the
+    pool from its own threads could deadlock it.
+    """
+    if (
+        not remote_funcs
+        or (len(remote_funcs) == 1 and not db_funcs)
+        or getattr(_worker_state, "in_worker", False)
+    ):
+        return [func() for func in remote_funcs], [func() for func in db_funcs]
+
+    futures = [
+        backend_executor.submit(_run_backend_call, func)
+        for func in remote_funcs
+    ]
+    db_results = [func() for func in db_funcs]
+    return [future.result() for future in futures], db_results
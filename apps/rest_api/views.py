@@ -1,32 +1,118 @@
 import base64
-import json
+import hashlib
 import logging
+import uuid
 from binascii import Error as Base64Error
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.db import transaction
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+)
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_GET, require_http_methods
+from django.views.decorators.http import (
+    conditional_page,
+    etag,
+    require_GET,
+    require_http_methods,
+    require_POST,
+)
 
 from apps.profiles.models import BaseProfileModel, Repo, TechAnalysis
-from apps.profiles.utils import (
-    dynamodb_get_profile_analysis,
-    dynamodb_get_repo_analysis,
+from apps.rest_api import portfolio
+from apps.rest_api.cache import (
+    SELECTED_REPOS,
+    USER_INFO,
+    USER_SOCIALS,
+    get_portfolio_data_version,
+)
+from apps.rest_api.serialization import FastJsonResponse, json_loads
+from apps.rest_api.signals import (
+    portfolio_data_changed,
+    repo_data_changed,
+    repos_changed,
+)
+from apps.rest_api.snapshots import (
+    PORTFOLIO,
+    get_repo_snapshot_name,
+    get_snapshot_response,
+    get_snapshot_version,
 )
 from apps.rest_api.utils import (
     validate_tech_analysis_data,
+    validate_bulk_tech_analysis_data,
     validate_profile_analysis_data,
+    validate_profile_analysis_patch_data,
     validate_repo_analysis_data,
     require_techanalysis_auth,
     require_lambda_auth,
     dynamic_cors_middleware,
+    compress_response,
+)
+from apps.widgets.utils import (
+    InvalidEventFrame,
+    count_beacon_events,
+    counter_buffer,
+    get_visitor_hash,
+    widget_lookup_cache,
 )
 
 
 logger = logging.getLogger(__name__)
 
+# Portfolio responses change rarely but must show edits right away, so
+# browsers revalidate them on every use, which their ETags make cheap
+revalidate_portfolio = cache_control(private=True, no_cache=True)
+
+
+def portfolio_etag(request, *args, **kwargs):
+    """
+    `etag_func` (see `django.views.decorators.http.etag`) for views behind
+    `dynamic_cors_middleware`. Derived from the portfolio user's data version,
+    the snapshot being served (which is regenerated after the version
+    changes) and the requested URL, so it's checked without building the
+    response.
+    """
+    user = request._portfolio_user
+    version = get_portfolio_data_version(user.id)
+    snapshot_version = get_snapshot_version(user.id)
+
+    key = f"{user.id}:{version}:{snapshot_version}:{request.get_full_path()}"
+
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def decode_repo_full_name(repo_full_name_b64):
+    try:
+        return base64.urlsafe_b64decode(repo_full_name_b64).decode()
+    except (Base64Error, UnicodeDecodeError):
+        return None
+
+
+def single_repo_etag(request, repo_full_name_b64):
+    """
+    Repos are shared by every user showing them, so besides the user's data
+    version (covering their tech analysis) the ETag includes the hash of the
+    repo's analysis
+    """
+    repo_full_name = decode_repo_full_name(repo_full_name_b64)
+    if repo_full_name is None:
+        return None
+
+    analysis_hash = portfolio.get_repo_analysis_hash(repo_full_name)
+    return hashlib.sha1(
+        f"{portfolio_etag(request)}:{analysis_hash}".encode()
+    ).hexdigest()
+
 
 @dynamic_cors_middleware
+@revalidate_portfolio
+@compress_response
+@etag(portfolio_etag)
 @require_GET
 def get_user_info(request):
     """
@@ -45,26 +131,18 @@ def get_user_info(request):
         }
     """
     user = request._portfolio_user
-    contact_info = getattr(user, "contact_info", None)
 
-    return JsonResponse(
-        {
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "tagline": user.tagline,
-            "username": user.username,
-            "contact_info": {
-                "email": contact_info.email,
-                "phone": contact_info.phone,
-                "address": contact_info.address,
-            }
-            if contact_info is not None
-            else None,
-        }
-    )
+    snapshot = get_snapshot_response(request, user.id, USER_INFO)
+    if snapshot is not None:
+        return snapshot
+
+    return FastJsonResponse(portfolio.get_user_info(user))
 
 
 @dynamic_cors_middleware
+@revalidate_portfolio
+@compress_response
+@etag(portfolio_etag)
 @require_GET
 def get_user_socials(request):
     """
@@ -85,10 +163,17 @@ def get_user_socials(request):
     """
     user = request._portfolio_user
 
-    return JsonResponse(user.social_links)
+    snapshot = get_snapshot_response(request, user.id, USER_SOCIALS)
+    if snapshot is not None:
+        return snapshot
+
+    return FastJsonResponse(portfolio.get_user_socials(user))
 
 
 @dynamic_cors_middleware
+@revalidate_portfolio
+@compress_response
+@etag(portfolio_etag)
 @require_GET
 def get_selected_repos(request):
     """
@@ -107,29 +192,76 @@ def get_selected_repos(request):
         - visibility: "public"
     """
     user = request._portfolio_user
-    prof_an = dynamodb_get_profile_analysis(
-        user.id, AttributesToGet=["repos", "selectedRepos"]
+
+    snapshot = get_snapshot_response(request, user.id, SELECTED_REPOS)
+    if snapshot is not None:
+        return snapshot
+
+    return FastJsonResponse(portfolio.get_selected_repos(user))
+
+
+def get_portfolio_bundle_fields(request):
+    fields = request.GET.get("fields")
+    return (
+        fields.split(",")
+        if fields
+        else portfolio.DEFAULT_PORTFOLIO_BUNDLE_FIELDS
     )
-    result = []
-    for repo_full_name in prof_an.get("selectedRepos", []):
-        repo = prof_an["repos"].pop(repo_full_name)
-        result.append(
-            {
-                "repo_name": repo_full_name.split("/", maxsplit=1)[1],
-                "repo_full_name": repo_full_name,
-                "description": repo["description"],
-                "external_url": f"https://github.com/{repo_full_name}",
-                "primary_language": repo["primaryLanguage"],
-                "visibility": "private"
-                if repo.get("isPrivate") is True
-                else "public",
-            }
-        )
 
-    return JsonResponse({"count": len(result), "repos": result})
+
+def portfolio_bundle_etag(request):
+    """
+    Widget counters change without a new portfolio data version, so bundles
+    including them are tagged by a hash of their content instead
+    """
+    fields = get_portfolio_bundle_fields(request)
+    if "widget" in fields or not set(fields).issubset(
+        portfolio.PORTFOLIO_BUNDLE_FIELDS
+    ):
+        return None
+
+    return portfolio_etag(request)
+
+
+@dynamic_cors_middleware
+@revalidate_portfolio
+@compress_response
+@conditional_page
+@etag(portfolio_bundle_etag)
+@require_GET
+def get_portfolio(request):
+    """
+    GET /portfolio/?fields=user_info,user_socials,selected_repos,widget
+
+    Returns the data of several portfolio endpoints in one response, keyed by
+    field name:
+        - user_info: as returned by /user_info/
+        - user_socials: as returned by /user_socials/
+        - selected_repos: as returned by /selected_repos/
+        - widget: { clicks, impressions } (null if the user has no widget)
+
+    `fields` is an optional comma separated list of the fields to include.
+    Defaults to user_info, user_socials and selected_repos.
+    """
+    user = request._portfolio_user
+
+    fields = get_portfolio_bundle_fields(request)
+    for field in fields:
+        if field not in portfolio.PORTFOLIO_BUNDLE_FIELDS:
+            return HttpResponseBadRequest(f"Unknown field {field}")
+
+    if fields == portfolio.DEFAULT_PORTFOLIO_BUNDLE_FIELDS:
+        snapshot = get_snapshot_response(request, user.id, PORTFOLIO)
+        if snapshot is not None:
+            return snapshot
+
+    return FastJsonResponse(portfolio.get_portfolio_bundle(user, fields))
 
 
 @dynamic_cors_middleware
+@cache_control(private=True, max_age=settings.PORTFOLIO_SINGLE_REPO_MAX_AGE)
+@compress_response
+@etag(single_repo_etag)
 @require_GET
 def get_single_repo(request, repo_full_name_b64):
     """
@@ -160,49 +292,25 @@ def get_single_repo(request, repo_full_name_b64):
     """
     user = request._portfolio_user
 
-    try:
-        repo_full_name = base64.urlsafe_b64decode(repo_full_name_b64).decode()
-    except Base64Error:
-        logger.exception(
+    repo_full_name = decode_repo_full_name(repo_full_name_b64)
+    if repo_full_name is None:
+        logger.error(
             f"Error while decoding base64 repo name {repo_full_name_b64}"
         )
         return HttpResponseBadRequest()
 
-    attributes_to_get = [
-        "archived",
-        "commits",
-        "contributors",
-        "created_at",
-        "default_branch",
-        "description",
-        "full_name",
-        "homepage",
-        "html_url",
-        "languages",
-        "license",
-        "name",
-        "owner",
-        "owner_avatar",
-        "private",
-        "pushed_at",
-        "size",
-        "stargazers_count",
-    ]
-
-    repo = dynamodb_get_repo_analysis(
-        repo_full_name, AttributesToGet=attributes_to_get
+    snapshot = get_snapshot_response(
+        request, user.id, get_repo_snapshot_name(repo_full_name)
     )
+    if snapshot is not None:
+        return snapshot
+
+    repo = portfolio.get_single_repo(user, repo_full_name)
     if repo is None:
         logger.exception(f"Repo not found {repo_full_name}")
         raise Http404()
 
-    tech = getattr(user, "tech_analysis", None)
-    if tech and repo_full_name in tech.repos:
-        repo["tech_stack"] = tech.repos[repo_full_name]
-    else:
-        repo["tech_stack"] = None
-
-    return JsonResponse(repo)
+    return FastJsonResponse(repo)
 
 
 @require_techanalysis_auth
@@ -243,35 +351,101 @@ def add_tech_analysis_repo(request, user_id):
             raise Http404()
 
         # Not hiding the endpoint (with 404) after this point
-        data = json.loads(request.body.decode("utf-8"))
+        data = json_loads(request.body)
         try:
             validate_tech_analysis_data(data)
         except AssertionError:
             logger.exception(f"Couldn't validate tech analysis data: {data}")
             return HttpResponseBadRequest()
 
-        if hasattr(user, "tech_analysis"):
-            tech_analysis = user.tech_analysis
-        else:
-            tech_analysis = TechAnalysis(user=user)
-
-        repo_name = data["repo_full_name"]
-        tech_analysis.repos[repo_name] = {
+        repo = {
             "libs": data["libs"],
             "tech": data["tech"],
             "tags": data["tags"],
         }
+        TechAnalysis.update_repos(user.id, {data["repo_full_name"]: repo})
+        repo_data_changed(user.id)
 
-        tech_analysis.full_clean()
-        tech_analysis.save()
-        return JsonResponse({"success": True})
+        return FastJsonResponse({"success": True})
     else:
         raise Http404()
 
 
+@require_techanalysis_auth
+@csrf_exempt
+@require_POST
+def add_tech_analysis_repos_bulk(request):
+    """
+    POST /tech_analysis/bulk/
+
+    Adds or replaces the tech analysis of many repos of many users at once.
+    Nothing is stored unless all the data is valid and all users exist. Every
+    user's tech analysis is updated once, in a single transaction.
+
+    Data format (JSON):
+
+    {
+        "<user_id>": [
+            {
+                "repo_full_name": "<ownerName>/<repoName>",
+                "libs": {...},
+                "tech": {...},
+                "tags": {...}
+            },
+            ...
+        ],
+        ...
+    }
+
+    (repos as accepted by /tech_analysis/<uuid:user_id>/add_repo/)
+    """
+    data = json_loads(request.body)
+    try:
+        validate_bulk_tech_analysis_data(data)
+    except AssertionError:
+        logger.exception("Couldn't validate bulk tech analysis data")
+        return HttpResponseBadRequest()
+
+    # Normalized, to match the ids read from the database
+    data = {str(uuid.UUID(user_id)): repos for user_id, repos in data.items()}
+    user_ids = set(data.keys())
+
+    users = get_user_model().objects.filter(id__in=user_ids)
+    existing_user_ids = {
+        str(user_id) for user_id in users.values_list("id", flat=True)
+    }
+    if existing_user_ids != user_ids:
+        raise Http404(f"Unknown users {user_ids - existing_user_ids}")
+
+    with transaction.atomic():
+        # In a fixed order, so concurrent bulk requests can't deadlock
+        for user_id in sorted(data):
+            repos = {
+                repo["repo_full_name"]: {
+                    "libs": repo["libs"],
+                    "tech": repo["tech"],
+                    "tags": repo["tags"],
+                }
+                for repo in data[user_id]
+            }
+            TechAnalysis.update_repos(user_id, repos)
+            repo_data_changed(user_id)
+
+    return FastJsonResponse(
+        {
+            "success": True,
+            "users": len(data),
+            "repos": sum(len(repos) for repos in data.values()),
+        }
+    )
+
+
 @require_lambda_auth
 @csrf_exempt
-@require_http_methods(["GET", "POST"])
+@cache_control(private=True, no_cache=True)
+@compress_response
+@conditional_page
+@require_http_methods(["GET", "POST", "PATCH"])
 def github_profile_analysis(request, user_id):
     """
     ---------------------------------------------------------------------------
@@ -296,6 +470,24 @@ def github_profile_analysis(request, user_id):
         }
     }
     ---------------------------------------------------------------------------
+    PATCH /profile_analysis/github/<uuid:user_id>/
+
+    > Update parts of the profile analysis of an existing user in-database,
+    > without resending the whole document
+
+    Expected data input format (JSON, all keys optional):
+    {
+        "user_profile": {
+            <field>: <value, or null to delete>
+        },
+        "repos": {
+            "<ownerName>/<repoName>": <repo, or null to delete>
+        },
+        "selectedRepos": [
+            ...
+        ]
+    }
+    ---------------------------------------------------------------------------
     """
     UserModel = get_user_model()
     try:
@@ -303,17 +495,22 @@ def github_profile_analysis(request, user_id):
     except UserModel.DoesNotExist:
         raise Http404()
 
+    profiles = user.profiles.filter(_provider="github")
+    if request.method == "PATCH":
+        # Patches are applied in-database, loading the (possibly
+        # multi-megabyte) profile analysis would defeat them
+        profiles = profiles.only("id")
     try:
-        profile = user.profiles.get(_provider="github")
+        profile = profiles.get()
     except BaseProfileModel.DoesNotExist:
         raise Http404("GitHub Profile isn't connected")
 
     if request.method == "GET":
-        return JsonResponse(profile.profile_analysis)
+        return FastJsonResponse(profile.profile_analysis)
 
     elif request.method == "POST":
         # Not hiding the endpoint (with 404) after this point
-        data = json.loads(request.body.decode("utf-8"))
+        data = json_loads(request.body)
         try:
             validate_profile_analysis_data(data)
         except AssertionError:
@@ -326,7 +523,24 @@ def github_profile_analysis(request, user_id):
         profile.full_clean()
         profile.save()
 
-        return JsonResponse({"success": True})
+        return FastJsonResponse({"success": True})
+
+    elif request.method == "PATCH":
+        # Not hiding the endpoint (with 404) after this point
+        data = json_loads(request.body)
+        try:
+            validate_profile_analysis_patch_data(data)
+        except AssertionError:
+            logger.exception(
+                f"Couldn't validate profile analysis patch: {data}"
+            )
+            return HttpResponseBadRequest()
+
+        profile.patch_profile_analysis(data)
+        # The update doesn't send post_save
+        portfolio_data_changed(user.id)
+
+        return FastJsonResponse({"success": True})
 
 
 @require_lambda_auth
@@ -350,39 +564,108 @@ def add_github_repo_analysis(request, user_id):
     provider = "github"
 
     if request.method == "POST":
-        UserModel = get_user_model()
-        try:
-            # Just validate if user id is real
-            UserModel.objects.get(id=user_id)
-        except UserModel.DoesNotExist:
+        # Just validate if user id is real
+        if not get_user_model().objects.filter(id=user_id).exists():
             raise Http404()
 
         # Not hiding the endpoint (with 404) after this point
-        data = json.loads(request.body.decode("utf-8"))
+        data = json_loads(request.body)
         try:
             validate_repo_analysis_data(data)
         except AssertionError:
             logger.exception(f"Couldn't validate repo analysis data: {data}")
             return HttpResponseBadRequest()
 
-        repo_id = data["id"]
-        repo_full_name = data["analysis"]["full_name"]
-        try:
-            repo = Repo.objects.get(
-                provider=provider, provider_repo_id=repo_id
-            )
-            repo.full_name = repo_full_name
-            repo.repo_analysis = data["analysis"]
-        except Repo.DoesNotExist:
-            repo = Repo(
-                provider=provider,
-                provider_repo_id=repo_id,
-                full_name=repo_full_name,
-                repo_analysis=data["analysis"],
-            )
+        written = Repo.upsert_analyses(
+            provider, {data["id"]: data["analysis"]}
+        )
+        if written:
+            # Repos aren't linked to users, so no signal can do this
+            repo_data_changed(user_id)
+            repos_changed(written)
 
-        repo.full_clean()
-        repo.save()
-        return JsonResponse({"success": True})
+        return FastJsonResponse({"success": True})
     else:
         raise Http404()
+
+
+@require_lambda_auth
+@csrf_exempt
+@require_POST
+def add_github_repo_analyses_bulk(request, user_id):
+    """
+    POST /repo_analysis/github/<uuid:user_id>/bulk/
+
+    Adds or updates many repo analyses at once. Nothing is stored unless all
+    of them are valid. Analyses identical to the stored ones aren't written.
+
+    Data format (JSON):
+
+    [
+        <repo analysis as accepted by /repo_analysis/github/<uuid:user_id>/>,
+        ...
+    ]
+
+    Returns the number of repos actually written as `written`.
+    """
+    if not get_user_model().objects.filter(id=user_id).exists():
+        raise Http404()
+
+    # Not hiding the endpoint (with 404) after this point
+    data = json_loads(request.body)
+    try:
+        assert isinstance(data, list)
+        for repo in data:
+            assert isinstance(repo, dict)
+            validate_repo_analysis_data(repo)
+    except AssertionError:
+        logger.exception("Couldn't validate bulk repo analysis data")
+        return HttpResponseBadRequest()
+
+    # Later analyses of the same repo win
+    analyses = {repo["id"]: repo["analysis"] for repo in data}
+    written = Repo.upsert_analyses("github", analyses)
+    if written:
+        repo_data_changed(user_id)
+        repos_changed(written)
+
+    return FastJsonResponse({"success": True, "written": len(written)})
+
+
+@csrf_exempt
+@require_POST
+def widget_beacon(request, user_id):
+    """
+    POST /widgets/<uuid:user_id>/beacon/
+
+    `navigator.sendBeacon` compatible alternative to the widget websocket for
+    short page visits. Counts are added to the same write-behind buffer as
+    websocket events, so they are coalesced per widget until the next flush.
+
+    Data format (JSON, sent with any content type):
+
+    {"clicks": 1, "impressions": 3}
+
+    or the event frames accepted by the widget websocket, e.g.
+
+    [{"event": "impression"}, {"event": "click"}]
+    """
+    widget_id = widget_lookup_cache.resolve(user_id)
+    if widget_id is None:
+        raise Http404()
+
+    try:
+        clicks, impressions = count_beacon_events(request.body.decode("utf-8"))
+    except (InvalidEventFrame, UnicodeDecodeError):
+        logger.exception("Couldn't parse widget beacon")
+        return HttpResponseBadRequest()
+
+    visitor = get_visitor_hash(
+        request.META.get("REMOTE_ADDR"),
+        request.META.get("HTTP_USER_AGENT"),
+        request.META.get("HTTP_X_FORWARDED_FOR"),
+    )
+    counter_buffer.add(
+        widget_id, clicks=clicks, impressions=impressions, visitor=visitor
+    )
+    return HttpResponse(status=204)
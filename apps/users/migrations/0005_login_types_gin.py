@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-18 18:20
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_auto_20210121_1736'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['login_types'], name='users_login_types_gin', opclasses=['jsonb_path_ops']),
+        ),
+    ]
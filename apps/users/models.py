@@ -7,6 +7,7 @@ from django.contrib.auth.models import (
 )
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
@@ -75,6 +76,16 @@ class UserManager(BaseUserManager):
             **extra_fields,
         )
 
+    def filter_by_login_type(self, provider, **fields):
+        """
+        Users whose `login_types[provider]` contains `fields`, e.g.
+        `filter_by_login_type("github", id=gh_id)`.
+
+        Uses JSONB containment (@>), which is served by the GIN index on
+        `login_types`, unlike key lookups (`login_types__github__id=...`).
+        """
+        return self.filter(login_types__contains={provider: fields})
+
 
 class User(AbstractBaseUser, PermissionsMixin):
     """
@@ -165,6 +176,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = "User"
         verbose_name_plural = "Users"
+        indexes = [
+            GinIndex(
+                fields=["login_types"],
+                name="users_login_types_gin",
+                opclasses=["jsonb_path_ops"],
+            ),
+        ]
 
     @property
     def full_name(self):
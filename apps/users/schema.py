@@ -305,7 +305,9 @@ class LoginWithGithub(GenericResultMutation):
 
             # Check if user already exists
             try:
-                user = UserModel.objects.get(login_types__github__id=gh_id)
+                user = UserModel.objects.filter_by_login_type(
+                    "github", id=gh_id
+                ).get()
             except UserModel.DoesNotExist:
                 email = github_get_primary_email(gh_token)
                 if email is None:
@@ -416,7 +418,7 @@ class AddGithubAuth(GenericResultMutation):
                 # Check if the GitHub account is already added to some user
                 if (
                     get_user_model()
-                    .objects.filter(login_types__github__id=gh_id)
+                    .objects.filter_by_login_type("github", id=gh_id)
                     .exists()
                 ):
                     return AddGithubAuth(
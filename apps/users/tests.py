@@ -1,3 +1,18 @@
-from django.test import TestCase  # noqa: F401
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
 
-# Create your tests here.
+
+class FilterByLoginTypeTests(TestCase):
+    def test_uses_login_types_gin_index(self):
+        queryset = get_user_model().objects.filter_by_login_type(
+            "github", id=12345
+        )
+
+        with connection.cursor() as cursor:
+            # Tiny test tables would be scanned otherwise. Reset at the end of
+            # the test's transaction
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+
+        self.assertIn("users_login_types_gin", plan)
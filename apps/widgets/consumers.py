@@ -1,15 +1,28 @@
+import asyncio
 import json
 import logging
 
-from channels.generic.websocket import WebsocketConsumer
+from channels.db import database_sync_to_async
+from channels.generic.websocket import (
+    AsyncWebsocketConsumer,
+    WebsocketConsumer,
+)
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 from apps.base.utils import get_model_object
+from apps.widgets.utils import (
+    InvalidEventFrame,
+    connection_limiter,
+    parse_event_frame,
+    counter_buffer,
+    get_visitor_hash_from_scope,
+    widget_lookup_cache,
+)
 
 logger = logging.getLogger(__name__)
 
-CLICK_EVENT = "click"
-IMPRESSION_EVENT = "impression"
+WIDGET_IDLE_TIMEOUT = settings.WIDGET_IDLE_TIMEOUT
 
 
 class WidgetConsumer(WebsocketConsumer):
@@ -31,41 +44,129 @@ class WidgetConsumer(WebsocketConsumer):
             return
 
         self.widget = user.widget
+        self.visitor = get_visitor_hash_from_scope(self.scope)
+        # Only counted, so the last close for the widget flushes its events
+        connection_limiter.acquire(self.widget.id, enforce_limit=False)
         self.accept()
 
     def disconnect(self, close_code):
+        widget = getattr(self, "widget", None)
+        if widget is not None and connection_limiter.release(widget.id):
+            counter_buffer.flush(widget.id)
+
         logger.debug(
             "A connection from %(source)s was closed"
             % {"source": self.scope.get("client")[0]}
         )
 
     def receive(self, text_data=None, bytes_data=None):
-        if bytes_data or not text_data:
-            raise NotImplementedError
+        try:
+            frame = parse_event_frame(text_data, bytes_data)
+        except InvalidEventFrame as e:
+            logger.critical(f"{e}. Closing connection")
+            self.close()
+            return
+
+        counter_buffer.add(
+            self.widget.id,
+            clicks=frame.clicks,
+            impressions=frame.impressions,
+            visitor=self.visitor,
+        )
+        if frame.ack is not None:
+            self.send(text_data=json.dumps({"ack": frame.ack}))
 
-        data = json.loads(text_data)
-        event = data["event"]
 
-        if event == CLICK_EVENT:
-            self.increment_clicks()
-        elif event == IMPRESSION_EVENT:
-            self.increment_impressions()
-        else:
-            logger.critical(
-                f"Unknown event {event} received. Closing connection"
+class AsyncWidgetConsumer(AsyncWebsocketConsumer):
+    """
+    Event-loop based equivalent of `WidgetConsumer`.
+
+    The only database access is resolving the widget on connect (one query
+    on a lookup cache miss, run in the database thread pool) and the flush
+    when the last connection for a widget closes. Events are handed to the
+    write-behind counter buffer, so idle and active sockets never hold a
+    worker thread.
+
+    Connections are capped per widget and closed after `WIDGET_IDLE_TIMEOUT`
+    seconds without events.
+    """
+
+    widget_id = None
+    has_connection_slot = False
+    idle_task = None
+
+    async def connect(self):
+        user_id = self.scope["url_route"]["kwargs"].get("user_id")
+        if not user_id:
+            logger.error(
+                "No user_id found in URL route. Rejecting WS connection"
             )
-            self.close()
+            await self.close()
+            return
+
+        self.widget_id = await database_sync_to_async(
+            widget_lookup_cache.resolve
+        )(user_id)
+        if self.widget_id is None:
+            logger.error("No matching widget. Closing websocket connection")
+            await self.close()
+            return
+
+        self.has_connection_slot = connection_limiter.acquire(self.widget_id)
+        if not self.has_connection_slot:
+            logger.warning(
+                f"Too many connections for widget {self.widget_id}. "
+                "Closing websocket connection"
+            )
+            await self.close()
+            return
+
+        self.visitor = get_visitor_hash_from_scope(self.scope)
+        self.last_activity = asyncio.get_event_loop().time()
+        await self.accept()
+        self.idle_task = asyncio.ensure_future(self.close_when_idle())
+
+    async def disconnect(self, close_code):
+        if self.idle_task is not None:
+            self.idle_task.cancel()
+
+        if not self.has_connection_slot:
+            return
+
+        self.has_connection_slot = False
+        # Short visits to a busy widget are left to the periodic flush, so
+        # their events coalesce into one write
+        if connection_limiter.release(self.widget_id):
+            await database_sync_to_async(counter_buffer.flush)(self.widget_id)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        self.last_activity = asyncio.get_event_loop().time()
+
+        try:
+            frame = parse_event_frame(text_data, bytes_data)
+        except InvalidEventFrame as e:
+            logger.critical(f"{e}. Closing connection")
+            await self.close()
+            return
+
+        counter_buffer.add(
+            self.widget_id,
+            clicks=frame.clicks,
+            impressions=frame.impressions,
+            visitor=self.visitor,
+        )
+        if frame.ack is not None:
+            await self.send(text_data=json.dumps({"ack": frame.ack}))
 
     # helpers
 
-    def increment_clicks(self):
-        self.widget.refresh_from_db()
-        self.widget.clicks += 1
-        self.widget.full_clean()
-        self.widget.save()
-
-    def increment_impressions(self):
-        self.widget.refresh_from_db()
-        self.widget.impressions += 1
-        self.widget.full_clean()
-        self.widget.save()
+    async def close_when_idle(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            idle_for = loop.time() - self.last_activity
+            if idle_for >= WIDGET_IDLE_TIMEOUT:
+                logger.debug("Closing idle widget websocket connection")
+                await self.close()
+                return
+
+            await asyncio.sleep(WIDGET_IDLE_TIMEOUT - idle_for)
@@ -0,0 +1,110 @@
+import hashlib
+import math
+
+from django.conf import settings
+
+HASH_BITS = 64
+# Keyed so that stored sketches can't be used to test for known visitors
+HASH_KEY = hashlib.sha256(settings.SECRET_KEY.encode()).digest()
+
+
+def hash_visitor(*parts):
+    """Returns a keyed 64 bit hash of the given visitor identifying strings"""
+    data = "\0".join(part or "" for part in parts).encode()
+    digest = hashlib.blake2b(data, digest_size=8, key=HASH_KEY).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch for approximate distinct counting.
+
+    Uses 2 ** 14 six bit registers, giving a standard error of about 0.8%.
+    Sketches of the same precision can be merged losslessly, so per-bucket
+    sketches can be combined into a sketch for any range of buckets.
+
+    Registers serialize to one byte each (16KB) rather than being packed
+    into 12KB. A flush then updates the registers of its few visitors in
+    place (`add_to_bytes`) instead of unpacking and repacking the whole
+    sketch on every write. Hourly bucket sketches are mostly zero
+    registers, which Postgres compresses (TOAST) well below either size, so
+    the extra 4KB is mostly paid by the few busy buckets.
+
+    Values are expected to be uniformly distributed 64 bit hashes (see
+    `hash_visitor`).
+    """
+
+    PRECISION = 14
+    REGISTER_COUNT = 1 << PRECISION
+    SERIALIZED_SIZE = REGISTER_COUNT
+
+    def __init__(self, registers=None):
+        self.registers = (
+            bytearray(self.REGISTER_COUNT) if registers is None else registers
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserializes a sketch. Empty data gives an empty sketch."""
+        if not data:
+            return cls()
+
+        if len(data) != cls.SERIALIZED_SIZE:
+            raise ValueError(f"Invalid sketch size {len(data)}")
+
+        return cls(bytearray(data))
+
+    @classmethod
+    def add_to_bytes(cls, data, values):
+        """
+        Adds `values` to a serialized sketch without deserializing all of it.
+        Returns the new serialization, or None if no register changed.
+        """
+        registers = cls.from_bytes(data).registers
+
+        changed = False
+        for value in values:
+            index, rank = cls._get_position(value)
+            if rank > registers[index]:
+                registers[index] = rank
+                changed = True
+
+        return bytes(registers) if changed else None
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    def add(self, value):
+        index, rank = self._get_position(value)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        m = self.REGISTER_COUNT
+        alpha = 0.7213 / (1 + 1.079 / m)
+        # Registers hold at most 51 (64 - PRECISION + 1)
+        harmonic_sum = sum(
+            self.registers.count(rank) * 2.0 ** -rank
+            for rank in range(HASH_BITS - self.PRECISION + 2)
+        )
+        estimate = alpha * m * m / harmonic_sum
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    # helpers
+
+    @classmethod
+    def _get_position(cls, value):
+        """The register index and rank of a hash"""
+        remaining_bits = HASH_BITS - cls.PRECISION
+        index = value >> remaining_bits
+        remaining = value & ((1 << remaining_bits) - 1)
+        return index, remaining_bits - remaining.bit_length() + 1
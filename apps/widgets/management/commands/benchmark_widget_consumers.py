@@ -0,0 +1,123 @@
+import asyncio
+import json
+import time
+import tracemalloc
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import path
+
+from apps.widgets.consumers import AsyncWidgetConsumer, WidgetConsumer
+from apps.widgets.utils import counter_buffer, get_widget_id_for_user
+
+CONSUMERS = {"sync": WidgetConsumer, "async": AsyncWidgetConsumer}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares how many concurrent widget websockets the sync and async "
+        "consumers can hold, in-process, against the configured database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "user_id", help="Id of a user who has a widget to connect to"
+        )
+        parser.add_argument(
+            "--connections",
+            type=int,
+            default=1000,
+            help="Sockets to hold open concurrently (default: 1000)",
+        )
+        parser.add_argument(
+            "--consumer",
+            choices=["sync", "async", "both"],
+            default="both",
+            help="Which consumer to benchmark (default: both)",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=30,
+            help="Seconds allowed per connection attempt (default: 30)",
+        )
+
+    def handle(self, user_id, connections, consumer, timeout, **options):
+        if get_widget_id_for_user(user_id) is None:
+            raise CommandError(f"User {user_id} has no widget")
+
+        names = ["sync", "async"] if consumer == "both" else [consumer]
+        for name in names:
+            result = asyncio.get_event_loop().run_until_complete(
+                self.run_benchmark(
+                    CONSUMERS[name], user_id, connections, timeout
+                )
+            )
+            self.report(name, result)
+
+        counter_buffer.flush()
+
+    async def run_benchmark(self, consumer_class, user_id, count, timeout):
+        application = URLRouter([path("ws/widgets/<user_id>", consumer_class)])
+
+        async def open_socket():
+            communicator = WebsocketCommunicator(
+                application, f"ws/widgets/{user_id}"
+            )
+            start = time.perf_counter()
+            try:
+                connected, _ = await communicator.connect(timeout=timeout)
+            except asyncio.TimeoutError:
+                connected = False
+            return communicator, connected, time.perf_counter() - start
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        opened = await asyncio.gather(*[open_socket() for _ in range(count)])
+        ramp_time = time.perf_counter() - start
+
+        sockets = [comm for comm, connected, _ in opened if connected]
+        latencies = [latency for _, connected, latency in opened if connected]
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[
+                comm.send_to(text_data=json.dumps({"event": "impression"}))
+                for comm in sockets
+            ]
+        )
+        event_time = time.perf_counter() - start
+
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        await asyncio.gather(*[comm.disconnect() for comm in sockets])
+
+        return {
+            "requested": count,
+            "connected": len(sockets),
+            "ramp_time": ramp_time,
+            "connect_p50": percentile(latencies, 50),
+            "connect_p99": percentile(latencies, 99),
+            "event_time": event_time,
+            "peak_memory": peak_memory,
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name} consumer: {result['connected']}/{result['requested']} "
+            f"sockets connected in {result['ramp_time']:.2f}s\n"
+            f"  connect latency p50 {result['connect_p50'] * 1000:.1f}ms, "
+            f"p99 {result['connect_p99'] * 1000:.1f}ms\n"
+            f"  one event per socket sent in {result['event_time']:.2f}s\n"
+            f"  peak traced memory {result['peak_memory'] / 2 ** 20:.1f}MiB"
+        )
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.widgets.utils import compact_stat_buckets
+
+
+class Command(BaseCommand):
+    help = "Folds hourly widget stat buckets older than N days into days"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.WIDGET_STATS_HOURLY_RETENTION_DAYS,
+            help="Keep hourly buckets for this many (whole) days",
+        )
+
+    def handle(self, days, **options):
+        today = timezone.now().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        older_than = today - timedelta(days=days)
+
+        folded = compact_stat_buckets(older_than)
+        self.stdout.write(
+            f"Folded {folded} hourly buckets older than {older_than}"
+        )
@@ -0,0 +1,325 @@
+import asyncio
+import base64
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.widgets.models import Widget, WidgetStatBucket
+from apps.widgets.utils import get_widget_id_for_user
+
+# daphne 2.x has no `python -m daphne` entrypoint
+DAPHNE_ENTRYPOINT = (
+    "from daphne.cli import CommandLineInterface; "
+    "CommandLineInterface.entrypoint()"
+)
+
+WS_OPCODE_TEXT = 0x1
+WS_OPCODE_CLOSE = 0x8
+WS_OPCODE_PING = 0x9
+WS_OPCODE_PONG = 0xA
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class WebsocketClosed(Exception):
+    pass
+
+
+class WebsocketClient:
+    """
+    Minimal RFC 6455 client on top of asyncio streams, enough to drive the
+    widget protocol (text frames only) without extra dependencies.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port, path):
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write(
+            (
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {host}:{port}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n"
+                "User-Agent: hyperlog-widget-loadtest\r\n\r\n"
+            ).encode()
+        )
+
+        response = await reader.readuntil(b"\r\n\r\n")
+        if not response.startswith(b"HTTP/1.1 101"):
+            writer.close()
+            raise WebsocketClosed(response.split(b"\r\n", 1)[0].decode())
+
+        return cls(reader, writer)
+
+    def send_text(self, text):
+        self._send_frame(WS_OPCODE_TEXT, text.encode())
+
+    async def receive_text(self):
+        while True:
+            opcode, payload = await self._read_frame()
+            if opcode == WS_OPCODE_TEXT:
+                return payload.decode()
+            if opcode == WS_OPCODE_CLOSE:
+                raise WebsocketClosed("Closed by server")
+            if opcode == WS_OPCODE_PING:
+                # daphne drops connections which don't answer its pings
+                self._send_frame(WS_OPCODE_PONG, payload)
+
+    async def close(self):
+        try:
+            self._send_frame(WS_OPCODE_CLOSE, struct.pack("!H", 1000))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+    # helpers
+
+    def _send_frame(self, opcode, payload):
+        length = len(payload)
+        header = bytes([0x80 | opcode])
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 1 << 16:
+            header += bytes([0x80 | 126]) + struct.pack("!H", length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", length)
+
+        # Client frames must be masked
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.writer.write(header + mask + masked)
+
+    async def _read_frame(self):
+        first, second = await self.reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            (length,) = struct.unpack("!H", await self.reader.readexactly(2))
+        elif length == 127:
+            (length,) = struct.unpack("!Q", await self.reader.readexactly(8))
+
+        return first & 0x0F, await self.reader.readexactly(length)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests the widget websocket against a locally started daphne "
+        "server and the configured (local) database. Reports connection ramp "
+        "latency, event throughput, ack latency and database writes/event"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "user_id", help="Id of a user who has a widget to connect to"
+        )
+        parser.add_argument(
+            "--connections",
+            type=int,
+            default=500,
+            help="Concurrent sockets to open (default: 500)",
+        )
+        parser.add_argument(
+            "--events",
+            type=int,
+            default=20,
+            help="Events sent by every socket (default: 20)",
+        )
+        parser.add_argument(
+            "--ramp-concurrency",
+            type=int,
+            default=100,
+            help="Connection attempts in flight at a time (default: 100)",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=0,
+            help="Port for the daphne server (default: a free port)",
+        )
+        parser.add_argument(
+            "--server",
+            help=(
+                "host:port of an already running server to test instead of "
+                "starting daphne"
+            ),
+        )
+
+    def handle(self, user_id, **options):
+        if get_widget_id_for_user(user_id) is None:
+            raise CommandError(f"User {user_id} has no widget")
+
+        server = None
+        if options["server"]:
+            host, port = options["server"].rsplit(":", 1)
+            port = int(port)
+        else:
+            host, port = "127.0.0.1", options["port"] or self.get_free_port()
+            server = self.start_daphne(host, port, options["connections"])
+
+        try:
+            writes_before = self.get_widget_table_writes()
+            result = asyncio.get_event_loop().run_until_complete(
+                self.run_loadtest(host, port, user_id, options)
+            )
+
+            # Wait for the write-behind buffer and the stats collector
+            time.sleep(settings.WIDGET_BUFFER_FLUSH_INTERVAL + 1)
+            result["db_writes"] = (
+                self.get_widget_table_writes() - writes_before
+            )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+        self.report(result)
+
+    async def run_loadtest(self, host, port, user_id, options):
+        path = f"/ws/widgets/{user_id}"
+        semaphore = asyncio.Semaphore(options["ramp_concurrency"])
+
+        async def open_socket():
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    client = await WebsocketClient.connect(host, port, path)
+                except (OSError, WebsocketClosed, asyncio.IncompleteReadError):
+                    return None, None
+                return client, time.perf_counter() - start
+
+        start = time.perf_counter()
+        opened = await asyncio.gather(
+            *[open_socket() for _ in range(options["connections"])]
+        )
+        ramp_time = time.perf_counter() - start
+
+        clients = [client for client, _ in opened if client is not None]
+        connect_latencies = [lat for client, lat in opened if client]
+
+        async def send_events(client):
+            latencies = []
+            for ack in range(options["events"]):
+                start = time.perf_counter()
+                client.send_text(
+                    json.dumps({"event": "impression", "ack": ack})
+                )
+                try:
+                    reply = json.loads(await client.receive_text())
+                except (WebsocketClosed, asyncio.IncompleteReadError):
+                    break
+                if reply.get("ack") == ack:
+                    latencies.append(time.perf_counter() - start)
+            return latencies
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[send_events(c) for c in clients])
+        event_time = time.perf_counter() - start
+
+        await asyncio.gather(*[client.close() for client in clients])
+
+        ack_latencies = [lat for latencies in results for lat in latencies]
+        return {
+            "requested": options["connections"],
+            "connected": len(clients),
+            "ramp_time": ramp_time,
+            "connect_p50": percentile(connect_latencies, 50),
+            "connect_p99": percentile(connect_latencies, 99),
+            "events": len(ack_latencies),
+            "event_time": event_time,
+            "ack_p50": percentile(ack_latencies, 50),
+            "ack_p99": percentile(ack_latencies, 99),
+        }
+
+    def report(self, result):
+        events = result["events"]
+        throughput = events / result["event_time"] if events else 0
+        writes_per_event = result["db_writes"] / events if events else 0
+
+        self.stdout.write(
+            f"Connections: {result['connected']}/{result['requested']} in "
+            f"{result['ramp_time']:.2f}s "
+            f"(p50 {result['connect_p50'] * 1000:.1f}ms, "
+            f"p99 {result['connect_p99'] * 1000:.1f}ms)\n"
+            f"Events: {events} acked in {result['event_time']:.2f}s "
+            f"({throughput:.0f} events/s)\n"
+            f"Ack latency: p50 {result['ack_p50'] * 1000:.1f}ms, "
+            f"p99 {result['ack_p99'] * 1000:.1f}ms\n"
+            f"DB writes: {result['db_writes']} "
+            f"({writes_per_event:.4f} per event)"
+        )
+
+    # helpers
+
+    def get_free_port(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    def start_daphne(self, host, port, connections):
+        env = dict(os.environ)
+        # Don't let admission control cap the test itself
+        env["WIDGET_MAX_CONNECTIONS_PER_WIDGET"] = str(connections)
+
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                DAPHNE_ENTRYPOINT,
+                "-b",
+                host,
+                "-p",
+                str(port),
+                "hyperlog.asgi:application",
+            ],
+            cwd=settings.BASE_DIR,
+            env=env,
+        )
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("daphne exited during startup")
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+
+        server.terminate()
+        raise CommandError("daphne didn't start listening within 30s")
+
+    def get_widget_table_writes(self):
+        """Rows inserted/updated in the widget tables, as seen by Postgres"""
+        tables = [Widget._meta.db_table, WidgetStatBucket._meta.db_table]
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_stat_clear_snapshot()")
+            cursor.execute(
+                """
+                SELECT COALESCE(SUM(n_tup_ins + n_tup_upd), 0)
+                FROM pg_stat_user_tables
+                WHERE relname = ANY(%s)
+                """,
+                [tables],
+            )
+            return cursor.fetchone()[0]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2 on 2026-10-18 17:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('widgets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WidgetStatBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('impressions', models.IntegerField(default=0)),
+                ('clicks', models.IntegerField(default=0)),
+                ('widget', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stat_buckets', to='widgets.Widget')),
+            ],
+            options={
+                'unique_together': {('widget', 'granularity', 'bucket_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('widgets', '0002_widgetstatbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='widget',
+            name='visitors_sketch',
+            field=models.BinaryField(blank=True, default=bytes),
+        ),
+        migrations.AddField(
+            model_name='widgetstatbucket',
+            name='visitors_sketch',
+            field=models.BinaryField(blank=True, default=bytes),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 
 class Widget(models.Model):
@@ -8,8 +10,55 @@ class Widget(models.Model):
     )
     impressions = models.IntegerField(default=0)
     clicks = models.IntegerField(default=0)
+    # Serialized `HyperLogLog` sketch of the visitors who saw the widget
+    visitors_sketch = models.BinaryField(default=bytes, blank=True)
 
     def __str__(self):
         return (
             f"<Widget clicks: {self.clicks} impressions: {self.impressions}>"
         )
+
+
+class WidgetStatBucket(models.Model):
+    """
+    Clicks and impressions of a widget within one time bucket.
+
+    Events are written to hourly buckets. Hourly buckets older than the
+    retention period are folded into daily buckets by the
+    `compact_widget_stats` management command.
+    """
+
+    HOUR = "hour"
+    DAY = "day"
+    GRANULARITY_CHOICES = [(HOUR, "Hour"), (DAY, "Day")]
+
+    widget = models.ForeignKey(
+        Widget, on_delete=models.CASCADE, related_name="stat_buckets"
+    )
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    impressions = models.IntegerField(default=0)
+    clicks = models.IntegerField(default=0)
+    visitors_sketch = models.BinaryField(default=bytes, blank=True)
+
+    class Meta:
+        # Also serves as the index for time range queries per widget
+        unique_together = ("widget", "granularity", "bucket_start")
+
+    def __str__(self):
+        return (
+            f"<WidgetStatBucket {self.granularity} {self.bucket_start} "
+            f"clicks: {self.clicks} impressions: {self.impressions}>"
+        )
+
+
+# Signals
+
+
+@receiver(post_save, sender=Widget)
+@receiver(post_delete, sender=Widget)
+def invalidate_widget_lookup(sender, instance, **kwargs):
+    # Imported here as utils depends on the models of this module
+    from apps.widgets.utils import widget_lookup_cache
+
+    widget_lookup_cache.invalidate(instance.user_id)
@@ -3,5 +3,9 @@ from django.urls import path
 from apps.widgets import consumers
 
 websocket_urlpatterns = [
-    path("ws/widgets/<user_id>", consumers.WidgetConsumer, name="ws_widgets")
+    path(
+        "ws/widgets/<user_id>",
+        consumers.AsyncWidgetConsumer,
+        name="ws_widgets",
+    )
 ]
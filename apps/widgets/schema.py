@@ -1,14 +1,80 @@
 import graphene
+from django.db.models.functions import Trunc
 from graphene_django import DjangoObjectType
+from graphql import GraphQLError
 from graphql_jwt.decorators import login_required
 
 from apps.base.utils import create_model_object
-from apps.widgets.models import Widget
+from apps.widgets.hyperloglog import HyperLogLog
+from apps.widgets.models import Widget, WidgetStatBucket
+
+
+class WidgetStatsBucketType(graphene.ObjectType):
+    bucket_start = graphene.DateTime(required=True)
+    clicks = graphene.Int(required=True)
+    impressions = graphene.Int(required=True)
+    unique_visitors = graphene.Int(required=True)
 
 
 class WidgetType(DjangoObjectType):
     class Meta:
         model = Widget
+        exclude = ("visitors_sketch",)
+
+    unique_visitors = graphene.Int(required=True)
+
+    stats = graphene.List(
+        graphene.NonNull(WidgetStatsBucketType),
+        start=graphene.DateTime(required=True),
+        end=graphene.DateTime(required=True),
+        granularity=graphene.String(default_value=WidgetStatBucket.DAY),
+    )
+
+    def resolve_unique_visitors(self, info):
+        return HyperLogLog.from_bytes(self.visitors_sketch).count()
+
+    def resolve_stats(self, info, start, end, granularity):
+        """
+        Time series of clicks/impressions in [start, end), one entry per
+        non-empty bucket. Daily series also include hourly buckets which
+        haven't been compacted yet. Hourly series only cover the range for
+        which hourly buckets are retained.
+        """
+        buckets = self.stat_buckets.filter(
+            bucket_start__gte=start, bucket_start__lt=end
+        )
+
+        if granularity == WidgetStatBucket.HOUR:
+            buckets = buckets.filter(granularity=WidgetStatBucket.HOUR)
+        elif granularity != WidgetStatBucket.DAY:
+            raise GraphQLError(f"Unknown granularity {granularity}")
+
+        rows = (
+            buckets.annotate(period=Trunc("bucket_start", granularity))
+            .values_list("period", "clicks", "impressions", "visitors_sketch")
+            .order_by("period")
+        )
+
+        # Sketches can't be merged in SQL, so buckets of the same period
+        # (daily and not yet compacted hourly ones) are combined here
+        series = []
+        for period, clicks, impressions, sketch_data in rows:
+            if not series or series[-1][0] != period:
+                series.append([period, 0, 0, HyperLogLog()])
+
+            series[-1][1] += clicks
+            series[-1][2] += impressions
+            series[-1][3].merge(HyperLogLog.from_bytes(sketch_data))
+
+        return [
+            WidgetStatsBucketType(
+                bucket_start=period,
+                clicks=clicks,
+                impressions=impressions,
+                unique_visitors=sketch.count(),
+            )
+            for period, clicks, impressions, sketch in series
+        ]
 
 
 class CreateWidget(graphene.Mutation):
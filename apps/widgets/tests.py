@@ -1,3 +1,211 @@
-from django.test import TestCase  # noqa: F401
+import json
+import random
+import struct
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from apps.widgets.hyperloglog import HyperLogLog, hash_visitor
+from apps.widgets.utils import (
+    BINARY_FRAME_FORMAT,
+    MAX_EVENTS_PER_FRAME,
+    EventFrame,
+    InvalidEventFrame,
+    count_beacon_events,
+    parse_event_frame,
+)
+
+
+def random_hashes(count, seed):
+    rnd = random.Random(seed)
+    return [rnd.getrandbits(64) for _ in range(count)]
+
+
+class HyperLogLogTests(SimpleTestCase):
+    def build_sketch(self, values):
+        sketch = HyperLogLog()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    def test_empty_sketch_counts_zero(self):
+        self.assertEqual(HyperLogLog().count(), 0)
+        self.assertEqual(HyperLogLog.from_bytes(None).count(), 0)
+        self.assertEqual(HyperLogLog.from_bytes(b"").count(), 0)
+
+    def test_count_accuracy(self):
+        for cardinality in [10, 1000, 50000, 200000]:
+            sketch = self.build_sketch(random_hashes(cardinality, cardinality))
+            error = abs(sketch.count() - cardinality) / cardinality
+            # About 4 standard errors of a 2 ** 14 register sketch
+            self.assertLess(error, 0.035, cardinality)
+
+    def test_count_ignores_duplicates(self):
+        values = random_hashes(1000, 1)
+        once = self.build_sketch(values)
+        twice = self.build_sketch(values + values)
+
+        self.assertEqual(once.count(), twice.count())
+
+    def test_hash_visitor_counts_distinct_visitors(self):
+        sketch = self.build_sketch(
+            hash_visitor(f"10.0.{i // 256}.{i % 256}", "agent")
+            for i in range(5000)
+            for _ in range(3)
+        )
+
+        self.assertAlmostEqual(sketch.count(), 5000, delta=5000 * 0.035)
+
+    def test_bytes_round_trip(self):
+        sketch = self.build_sketch(random_hashes(3000, 2))
+        data = sketch.to_bytes()
+
+        self.assertEqual(len(data), HyperLogLog.SERIALIZED_SIZE)
+        restored = HyperLogLog.from_bytes(data)
+        self.assertEqual(restored.registers, sketch.registers)
+        self.assertEqual(restored.count(), sketch.count())
+        # Postgres hands bytea values back as memoryview
+        restored = HyperLogLog.from_bytes(memoryview(data))
+        self.assertEqual(restored.registers, sketch.registers)
+
+    def test_from_bytes_rejects_invalid_size(self):
+        with self.assertRaises(ValueError):
+            HyperLogLog.from_bytes(b"\0" * (HyperLogLog.SERIALIZED_SIZE - 1))
+
+    def test_merge_equals_sketch_of_union(self):
+        first, second = random_hashes(4000, 3), random_hashes(6000, 4)
+        merged = self.build_sketch(first)
+        merged.merge(self.build_sketch(second))
+
+        self.assertEqual(
+            merged.registers, self.build_sketch(first + second).registers
+        )
+
+    def test_merge_with_overlap(self):
+        values = random_hashes(8000, 5)
+        merged = self.build_sketch(values[:5000])
+        merged.merge(self.build_sketch(values[3000:]))
+
+        self.assertAlmostEqual(merged.count(), 8000, delta=8000 * 0.035)
+
+    def test_add_to_bytes_matches_add(self):
+        stored, new = random_hashes(2000, 6), random_hashes(50, 7)
+        data = HyperLogLog.add_to_bytes(
+            self.build_sketch(stored).to_bytes(), new
+        )
+
+        self.assertEqual(data, self.build_sketch(stored + new).to_bytes())
+
+    def test_add_to_bytes_on_empty_data(self):
+        values = random_hashes(10, 8)
+
+        for empty in [None, b""]:
+            self.assertEqual(
+                HyperLogLog.add_to_bytes(empty, values),
+                self.build_sketch(values).to_bytes(),
+            )
+
+    def test_add_to_bytes_returns_none_without_changes(self):
+        values = random_hashes(500, 9)
+        data = self.build_sketch(values).to_bytes()
+
+        self.assertIsNone(HyperLogLog.add_to_bytes(data, values[:100]))
+        self.assertIsNone(HyperLogLog.add_to_bytes(data, []))
+
+    def test_add_to_bytes_does_not_modify_input(self):
+        data = bytearray(HyperLogLog().to_bytes())
+        HyperLogLog.add_to_bytes(data, random_hashes(10, 10))
+
+        self.assertEqual(data, bytearray(HyperLogLog.SERIALIZED_SIZE))
+
+
+class ParseEventFrameTests(SimpleTestCase):
+    def test_single_event(self):
+        self.assertEqual(
+            parse_event_frame(text_data='{"event": "click"}'),
+            EventFrame(clicks=1, impressions=0),
+        )
+        self.assertEqual(
+            parse_event_frame(text_data='{"event": "impression"}'),
+            EventFrame(clicks=0, impressions=1),
+        )
+
+    def test_event_array(self):
+        events = [{"event": "click"}] * 2 + [{"event": "impression"}] * 3
+
+        self.assertEqual(
+            parse_event_frame(text_data=json.dumps(events)),
+            EventFrame(clicks=2, impressions=3),
+        )
+
+    def test_events_object_with_ack(self):
+        data = {"events": [{"event": "click"}], "ack": 7}
+
+        self.assertEqual(
+            parse_event_frame(text_data=json.dumps(data)),
+            EventFrame(clicks=1, impressions=0, ack=7),
+        )
+
+    def test_binary_frame(self):
+        data = struct.pack(BINARY_FRAME_FORMAT, 4, 9)
+
+        self.assertEqual(
+            parse_event_frame(bytes_data=data),
+            EventFrame(clicks=4, impressions=9),
+        )
+
+    def test_invalid_frames(self):
+        frames = [
+            {"text_data": None, "bytes_data": None},
+            {"text_data": "not json"},
+            {"text_data": '"click"'},
+            {"text_data": '{"event": "hover"}'},
+            {"text_data": '[{"event": "click"}, "click"]'},
+            {"text_data": '{"events": {"event": "click"}}'},
+            {"bytes_data": b"\x00\x01"},
+            {"bytes_data": struct.pack("!III", 1, 2, 3)},
+        ]
+        for frame in frames:
+            with self.assertRaises(InvalidEventFrame, msg=frame):
+                parse_event_frame(**frame)
+
+    def test_too_many_events(self):
+        events = [{"event": "click"}] * (MAX_EVENTS_PER_FRAME + 1)
+        with self.assertRaises(InvalidEventFrame):
+            parse_event_frame(text_data=json.dumps(events))
+
+        data = struct.pack(BINARY_FRAME_FORMAT, MAX_EVENTS_PER_FRAME, 1)
+        with self.assertRaises(InvalidEventFrame):
+            parse_event_frame(bytes_data=data)
+
+
+class CountBeaconEventsTests(SimpleTestCase):
+    def test_event_frames(self):
+        events = [{"event": "click"}, {"event": "impression"}] * 2
+
+        self.assertEqual(count_beacon_events('{"event": "click"}'), (1, 0))
+        self.assertEqual(count_beacon_events(json.dumps(events)), (2, 2))
+        self.assertEqual(
+            count_beacon_events(json.dumps({"events": events})), (2, 2)
+        )
+
+    def test_aggregated_counts(self):
+        self.assertEqual(
+            count_beacon_events('{"clicks": 2, "impressions": 5}'), (2, 5)
+        )
+        self.assertEqual(count_beacon_events('{"impressions": 3}'), (0, 3))
+        self.assertEqual(count_beacon_events("{}"), (0, 0))
+
+    def test_invalid_beacons(self):
+        bodies = [
+            "",
+            "not json",
+            '{"clicks": 1, "views": 2}',
+            '{"clicks": -1}',
+            '{"clicks": 1.5}',
+            '{"clicks": true}',
+            '{"clicks": "1"}',
+            json.dumps({"clicks": MAX_EVENTS_PER_FRAME, "impressions": 1}),
+        ]
+        for body in bodies:
+            with self.assertRaises(InvalidEventFrame, msg=body):
+                count_beacon_events(body)
@@ -0,0 +1,601 @@
+import atexit
+import json
+import logging
+import struct
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.widgets.hyperloglog import HyperLogLog, hash_visitor
+from apps.widgets.models import Widget, WidgetStatBucket
+
+logger = logging.getLogger(__name__)
+
+WIDGET_BUFFER_FLUSH_INTERVAL = settings.WIDGET_BUFFER_FLUSH_INTERVAL
+WIDGET_BUFFER_MAX_DELTA = settings.WIDGET_BUFFER_MAX_DELTA
+WIDGET_LOOKUP_CACHE_SIZE = settings.WIDGET_LOOKUP_CACHE_SIZE
+WIDGET_LOOKUP_CACHE_TTL = settings.WIDGET_LOOKUP_CACHE_TTL
+WIDGET_LOOKUP_CACHE_NEGATIVE_TTL = settings.WIDGET_LOOKUP_CACHE_NEGATIVE_TTL
+WIDGET_MAX_CONNECTIONS_PER_WIDGET = settings.WIDGET_MAX_CONNECTIONS_PER_WIDGET
+
+CLICK_EVENT = "click"
+IMPRESSION_EVENT = "impression"
+
+# Binary frames are two big-endian unsigned 32 bit ints: clicks, impressions
+BINARY_FRAME_FORMAT = "!II"
+MAX_EVENTS_PER_FRAME = 1000
+
+
+class InvalidEventFrame(Exception):
+    pass
+
+
+class EventFrame(typing.NamedTuple):
+    clicks: int
+    impressions: int
+    # Sent back to the client as {"ack": ...} once the frame is buffered
+    ack: typing.Optional[typing.Any] = None
+
+
+def parse_event_frame(text_data=None, bytes_data=None):
+    """
+    Parses a widget websocket frame into an `EventFrame`.
+
+    Accepted frames:
+    * text - a single event object: {"event": "click"}
+    * text - an array of event objects: [{"event": "click"}, ...]
+    * text - an object with an events array: {"events": [...]}
+    * binary - `struct.pack(BINARY_FRAME_FORMAT, clicks, impressions)`
+
+    Text frames which are objects may also carry an "ack" value, which the
+    consumer echoes back once the events are buffered.
+
+    Raises `InvalidEventFrame` for malformed frames, unknown events or frames
+    carrying more than `MAX_EVENTS_PER_FRAME` events.
+    """
+    ack = None
+
+    if bytes_data:
+        try:
+            clicks, impressions = struct.unpack(
+                BINARY_FRAME_FORMAT, bytes_data
+            )
+        except struct.error:
+            raise InvalidEventFrame(f"Malformed binary frame {bytes_data!r}")
+    elif text_data:
+        try:
+            data = json.loads(text_data)
+        except ValueError:
+            raise InvalidEventFrame(f"Malformed text frame {text_data}")
+
+        if isinstance(data, dict):
+            ack = data.get("ack")
+            events = data["events"] if "events" in data else [data]
+        else:
+            events = data
+
+        if not isinstance(events, list):
+            raise InvalidEventFrame(f"Malformed text frame {text_data}")
+        if len(events) > MAX_EVENTS_PER_FRAME:
+            raise InvalidEventFrame(f"Too many events ({len(events)})")
+
+        clicks = impressions = 0
+        for event_data in events:
+            event = (
+                event_data.get("event")
+                if isinstance(event_data, dict)
+                else None
+            )
+            if event == CLICK_EVENT:
+                clicks += 1
+            elif event == IMPRESSION_EVENT:
+                impressions += 1
+            else:
+                raise InvalidEventFrame(f"Unknown event {event} received")
+    else:
+        raise InvalidEventFrame("Empty frame received")
+
+    if clicks + impressions > MAX_EVENTS_PER_FRAME:
+        raise InvalidEventFrame(
+            f"Too many events ({clicks} clicks, {impressions} impressions)"
+        )
+
+    return EventFrame(clicks=clicks, impressions=impressions, ack=ack)
+
+
+def get_widget_id_for_user(user_id):
+    """
+    Resolves a user id to the id of the user's widget with a single query.
+    Returns None if the user does not exist, has no widget or if `user_id`
+    is not a valid UUID.
+    """
+    try:
+        return (
+            Widget.objects.filter(user_id=user_id)
+            .values_list("id", flat=True)
+            .first()
+        )
+    except ValidationError:
+        return None
+
+
+class WidgetLookupCache:
+    """
+    Bounded, per-process LRU cache of user id -> widget id.
+
+    Entries expire after `ttl` seconds. Unknown user ids (no user, no widget
+    or not a UUID) are cached as well, for the shorter `negative_ttl`, so that
+    floods of invalid ids don't reach the database.
+    """
+
+    def __init__(self, maxsize, ttl, negative_ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        # user_id -> (widget_id, expires_at)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, user_id):
+        """
+        Returns the widget id for `user_id` (or None), only querying the
+        database on a cache miss.
+        """
+        user_id = str(user_id)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                return entry[0]
+
+        widget_id = get_widget_id_for_user(user_id)
+        ttl = self.ttl if widget_id is not None else self.negative_ttl
+
+        with self._lock:
+            self._entries[user_id] = (widget_id, now + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return widget_id
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+
+class WidgetConnectionLimiter:
+    """Per-process cap on concurrent websocket connections per widget"""
+
+    def __init__(self, max_connections):
+        self.max_connections = max_connections
+
+        # widget_id -> open connections
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, widget_id, enforce_limit=True):
+        """Reserves a connection slot. Returns False if the widget is full."""
+        with self._lock:
+            count = self._connections.get(widget_id, 0)
+            if enforce_limit and count >= self.max_connections:
+                return False
+
+            self._connections[widget_id] = count + 1
+            return True
+
+    def release(self, widget_id):
+        """
+        Frees a connection slot. Returns True if it was the last open
+        connection for the widget in this process.
+        """
+        with self._lock:
+            count = self._connections.get(widget_id, 0) - 1
+            if count > 0:
+                self._connections[widget_id] = count
+                return False
+
+            self._connections.pop(widget_id, None)
+            return True
+
+
+def count_beacon_events(body):
+    """
+    Parses the body of a widget beacon and returns a (clicks, impressions)
+    pair.
+
+    Besides everything accepted by `parse_event_frame` as a text frame, a
+    beacon may carry pre-aggregated counts: {"clicks": 2, "impressions": 5}
+
+    Raises `InvalidEventFrame` for malformed or oversized bodies.
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise InvalidEventFrame(f"Malformed beacon {body}")
+
+    if not isinstance(data, dict) or "event" in data or "events" in data:
+        frame = parse_event_frame(text_data=body)
+        return frame.clicks, frame.impressions
+
+    if not set(data.keys()) <= {"clicks", "impressions"}:
+        raise InvalidEventFrame(f"Unexpected keys in beacon {body}")
+
+    clicks, impressions = data.get("clicks", 0), data.get("impressions", 0)
+    for count in [clicks, impressions]:
+        if type(count) is not int or count < 0:
+            raise InvalidEventFrame(f"Invalid count in beacon {body}")
+
+    if clicks + impressions > MAX_EVENTS_PER_FRAME:
+        raise InvalidEventFrame(
+            f"Too many events ({clicks} clicks, {impressions} impressions)"
+        )
+
+    return clicks, impressions
+
+
+def get_visitor_hash(client_host, user_agent, forwarded_for=None):
+    """
+    Fingerprints a widget visitor from their address and user agent. The
+    first `X-Forwarded-For` address is preferred over the client address as
+    it is the real client when running behind a proxy.
+    """
+    if forwarded_for:
+        client_host = forwarded_for.split(",")[0].strip()
+
+    return hash_visitor(client_host, user_agent)
+
+
+def get_visitor_hash_from_scope(scope):
+    """`get_visitor_hash` for a Channels (ASGI) connection scope"""
+    headers = dict(scope.get("headers", []))
+    client = scope.get("client") or [None]
+
+    return get_visitor_hash(
+        client[0],
+        headers.get(b"user-agent", b"").decode("latin1"),
+        headers.get(b"x-forwarded-for", b"").decode("latin1"),
+    )
+
+
+def truncate_to_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def merge_sketch_into(queryset, sketch):
+    """
+    Merges a `HyperLogLog` sketch into the `visitors_sketch` of the single row
+    matched by `queryset`, locking the row while the sketch is updated. The
+    row isn't written if no register changed.
+    """
+    row = queryset.select_for_update().only("id", "visitors_sketch").first()
+    if row is None:
+        return
+
+    stored = HyperLogLog.from_bytes(row.visitors_sketch)
+    merged = HyperLogLog(bytearray(stored.registers))
+    merged.merge(sketch)
+    if merged.registers != stored.registers:
+        queryset.model.objects.filter(id=row.id).update(
+            visitors_sketch=merged.to_bytes()
+        )
+
+
+def add_visitors_to_sketch(queryset, visitors):
+    """
+    Like `merge_sketch_into`, for a few visitor hashes. Only the registers of
+    those visitors are touched instead of merging whole sketches.
+    """
+    row = queryset.select_for_update().only("id", "visitors_sketch").first()
+    if row is None:
+        return
+
+    data = HyperLogLog.add_to_bytes(row.visitors_sketch, visitors)
+    if data is not None:
+        queryset.model.objects.filter(id=row.id).update(visitors_sketch=data)
+
+
+def upsert_stat_buckets(rows):
+    """
+    Adds clicks/impressions to widget stat buckets with a single
+    `INSERT ... ON CONFLICT ... DO UPDATE` statement.
+
+    Parameters:
+    * rows {List[Tuple]}: (widget_id, granularity, bucket_start, clicks,
+    impressions) tuples. Buckets which don't exist yet are created.
+    """
+    if not rows:
+        return
+
+    table = WidgetStatBucket._meta.db_table
+    widget_table = Widget._meta.db_table
+    values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(rows))
+    params = [value for row in rows for value in row]
+
+    # Joining on the widgets table skips rows of widgets deleted meanwhile
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} AS bucket
+                (widget_id, granularity, bucket_start, clicks, impressions,
+                visitors_sketch)
+            SELECT v.widget_id, v.granularity, v.bucket_start,
+                v.clicks, v.impressions, ''::bytea
+            FROM (VALUES {values}) AS v
+                (widget_id, granularity, bucket_start, clicks, impressions)
+            JOIN {widget_table} ON {widget_table}.id = v.widget_id
+            ON CONFLICT (widget_id, granularity, bucket_start) DO UPDATE
+            SET clicks = bucket.clicks + EXCLUDED.clicks,
+                impressions = bucket.impressions + EXCLUDED.impressions
+            """,
+            params,
+        )
+
+
+def compact_visitor_sketches(older_than):
+    """
+    Merges the visitor sketches of hourly stat buckets which start before
+    `older_than` into the sketches of their daily buckets. Only one merged
+    sketch is held in memory at a time.
+    """
+    hourly = (
+        WidgetStatBucket.objects.filter(
+            granularity=WidgetStatBucket.HOUR, bucket_start__lt=older_than
+        )
+        .exclude(visitors_sketch=b"")
+        .order_by("widget_id", "bucket_start")
+        .values_list("widget_id", "bucket_start", "visitors_sketch")
+    )
+
+    def save(key, sketch):
+        widget_id, day = key
+        upsert_stat_buckets([(widget_id, WidgetStatBucket.DAY, day, 0, 0)])
+        merge_sketch_into(
+            WidgetStatBucket.objects.filter(
+                widget_id=widget_id,
+                granularity=WidgetStatBucket.DAY,
+                bucket_start=day,
+            ),
+            sketch,
+        )
+
+    current_key, current_sketch = None, None
+    for widget_id, bucket_start, data in hourly.iterator():
+        key = (widget_id, bucket_start.replace(hour=0))
+        if key != current_key:
+            if current_key is not None:
+                save(current_key, current_sketch)
+            current_key, current_sketch = key, HyperLogLog()
+
+        current_sketch.merge(HyperLogLog.from_bytes(data))
+
+    if current_key is not None:
+        save(current_key, current_sketch)
+
+
+def compact_stat_buckets(older_than):
+    """
+    Folds hourly stat buckets which start before `older_than` into daily
+    buckets, deleting the hourly rows in the same statement. Visitor sketches
+    are merged into the daily buckets' sketches beforehand.
+
+    Returns the number of hourly buckets that were folded.
+    """
+    table = WidgetStatBucket._meta.db_table
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        compact_visitor_sketches(older_than)
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {table}
+                WHERE granularity = %s AND bucket_start < %s
+                RETURNING widget_id, bucket_start, clicks, impressions
+            ), folded AS (
+                INSERT INTO {table} AS bucket
+                    (widget_id, granularity, bucket_start, clicks, impressions,
+                    visitors_sketch)
+                SELECT
+                    widget_id,
+                    %s,
+                    date_trunc('day', bucket_start),
+                    SUM(clicks),
+                    SUM(impressions),
+                    ''::bytea
+                FROM moved
+                GROUP BY widget_id, date_trunc('day', bucket_start)
+                ON CONFLICT (widget_id, granularity, bucket_start)
+                DO UPDATE SET
+                    clicks = bucket.clicks + EXCLUDED.clicks,
+                    impressions = bucket.impressions + EXCLUDED.impressions
+            )
+            SELECT COUNT(*) FROM moved
+            """,
+            [WidgetStatBucket.HOUR, older_than, WidgetStatBucket.DAY],
+        )
+        return cursor.fetchone()[0]
+
+
+class WidgetDelta:
+    """Buffered, not yet written, changes for one widget"""
+
+    def __init__(self):
+        self.clicks = 0
+        self.impressions = 0
+        # Hashes of visitors seen since the last flush
+        self.visitors = set()
+
+    @property
+    def events(self):
+        return self.clicks + self.impressions
+
+    def merge(self, other):
+        self.clicks += other.clicks
+        self.impressions += other.impressions
+        self.visitors |= other.visitors
+
+
+class WidgetCounterBuffer:
+    """
+    Per-process write-behind buffer for widget clicks and impressions.
+
+    Deltas are accumulated in memory per widget and written to the database
+    as a single `F()` expression update per widget, either when the flush
+    interval elapses or when a widget's buffered delta reaches `max_delta`.
+    Each flush also adds the deltas to the widgets' current hourly stat
+    bucket, and merges the visitors seen into the unique visitor sketches of
+    the widget and of that bucket.
+
+    `add()` never touches the database, so it is safe to call from the
+    event loop. Flushes happen on a daemon thread, on `flush()` calls (e.g.
+    when a websocket disconnects) and at interpreter shutdown.
+    """
+
+    def __init__(self, flush_interval, max_delta):
+        self.flush_interval = flush_interval
+        self.max_delta = max_delta
+
+        # widget_id -> WidgetDelta
+        self._deltas = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def add(self, widget_id, clicks=0, impressions=0, visitor=None):
+        """
+        Buffers clicks/impressions for a widget. `visitor` is an optional
+        `hash_visitor()` hash of the client the events came from.
+        """
+        with self._lock:
+            delta = self._deltas.setdefault(widget_id, WidgetDelta())
+            delta.clicks += clicks
+            delta.impressions += impressions
+            if visitor is not None:
+                delta.visitors.add(visitor)
+            should_flush = delta.events >= self.max_delta
+
+        self._ensure_flusher()
+        if should_flush:
+            self._wakeup.set()
+
+    def flush(self, widget_id=None):
+        """
+        Write buffered deltas to the database. Flushes every widget when
+        `widget_id` is None, otherwise just the given widget.
+        """
+        with self._lock:
+            if widget_id is None:
+                deltas, self._deltas = self._deltas, {}
+            elif widget_id in self._deltas:
+                deltas = {widget_id: self._deltas.pop(widget_id)}
+            else:
+                return
+
+        if not deltas:
+            return
+
+        self._write(deltas)
+
+    # helpers
+
+    def _write(self, deltas):
+        """
+        Writes each widget's delta in its own short transaction, in widget id
+        order so that concurrent flushes of several processes lock rows in
+        the same order. Deltas which weren't written are re-buffered.
+        """
+        bucket_start = truncate_to_hour(timezone.now())
+
+        widget_ids = sorted(deltas)
+        for position, widget_id in enumerate(widget_ids):
+            try:
+                self._write_widget(widget_id, deltas[widget_id], bucket_start)
+            except Exception:
+                logger.exception(
+                    "Couldn't flush widget counters. Re-buffering"
+                )
+                with self._lock:
+                    for w_id in widget_ids[position:]:
+                        self._deltas.setdefault(w_id, WidgetDelta()).merge(
+                            deltas[w_id]
+                        )
+                return
+
+    def _write_widget(self, widget_id, delta, bucket_start):
+        with transaction.atomic():
+            Widget.objects.filter(id=widget_id).update(
+                clicks=F("clicks") + delta.clicks,
+                impressions=F("impressions") + delta.impressions,
+            )
+            upsert_stat_buckets(
+                [
+                    (
+                        widget_id,
+                        WidgetStatBucket.HOUR,
+                        bucket_start,
+                        delta.clicks,
+                        delta.impressions,
+                    )
+                ]
+            )
+
+            if delta.visitors:
+                add_visitors_to_sketch(
+                    Widget.objects.filter(id=widget_id), delta.visitors
+                )
+                add_visitors_to_sketch(
+                    WidgetStatBucket.objects.filter(
+                        widget_id=widget_id,
+                        granularity=WidgetStatBucket.HOUR,
+                        bucket_start=bucket_start,
+                    ),
+                    delta.visitors,
+                )
+
+    def _ensure_flusher(self):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="widget-counter-flusher"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            timeout = self.flush_interval - (time.monotonic() - last_flush)
+            self._wakeup.wait(timeout=max(timeout, 0))
+            self._wakeup.clear()
+
+            close_old_connections()
+            self.flush()
+            last_flush = time.monotonic()
+
+
+widget_lookup_cache = WidgetLookupCache(
+    maxsize=WIDGET_LOOKUP_CACHE_SIZE,
+    ttl=WIDGET_LOOKUP_CACHE_TTL,
+    negative_ttl=WIDGET_LOOKUP_CACHE_NEGATIVE_TTL,
+)
+connection_limiter = WidgetConnectionLimiter(
+    max_connections=WIDGET_MAX_CONNECTIONS_PER_WIDGET
+)
+counter_buffer = WidgetCounterBuffer(
+    flush_interval=WIDGET_BUFFER_FLUSH_INTERVAL,
+    max_delta=WIDGET_BUFFER_MAX_DELTA,
+)
+atexit.register(counter_buffer.flush)
@@ -74,6 +74,7 @@ INSTALLED_APPS = [
     "apps.profiles",
     "apps.widgets",
     "apps.messaging",
+    "apps.rest_api",
 ]
 
 MIDDLEWARE = [
@@ -132,6 +133,32 @@ TEMPLATES = [
 ASGI_APPLICATION = "hyperlog.routing.application"
 
 
+# Widgets
+
+# Seconds between write-behind flushes of widget clicks/impressions
+WIDGET_BUFFER_FLUSH_INTERVAL = env.int(
+    "WIDGET_BUFFER_FLUSH_INTERVAL", default=5
+)
+# Buffered clicks + impressions for a widget which force an early flush
+WIDGET_BUFFER_MAX_DELTA = env.int("WIDGET_BUFFER_MAX_DELTA", default=100)
+# Days for which hourly widget stats are kept before being folded into days
+WIDGET_STATS_HOURLY_RETENTION_DAYS = env.int(
+    "WIDGET_STATS_HOURLY_RETENTION_DAYS", default=7
+)
+# Per-process user id -> widget id cache (entries, seconds, seconds)
+WIDGET_LOOKUP_CACHE_SIZE = env.int("WIDGET_LOOKUP_CACHE_SIZE", default=10000)
+WIDGET_LOOKUP_CACHE_TTL = env.int("WIDGET_LOOKUP_CACHE_TTL", default=300)
+WIDGET_LOOKUP_CACHE_NEGATIVE_TTL = env.int(
+    "WIDGET_LOOKUP_CACHE_NEGATIVE_TTL", default=30
+)
+# Per-process limits for widget websockets
+WIDGET_MAX_CONNECTIONS_PER_WIDGET = env.int(
+    "WIDGET_MAX_CONNECTIONS_PER_WIDGET", default=1000
+)
+# Seconds without any event after which a widget websocket is closed
+WIDGET_IDLE_TIMEOUT = env.int("WIDGET_IDLE_TIMEOUT", default=300)
+
+
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
@@ -147,6 +174,18 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+# Per-process memory by default. Point CACHE_URL at a shared backend (e.g.
+# memcached) so that invalidation reaches every worker
+CACHES = {
+    "default": env.cache(
+        "CACHE_URL", default="locmemcache://?max_entries=20000"
+    )
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -319,6 +358,62 @@ TG_AUTH_SECRET = env("TG_AUTH_SECRET")
 TG_BOT_ENDPOINT = env("TG_BOT_ENDPOINT")
 
 
+# REST API
+
+# Seconds for which portfolio responses are cached (invalidated on change)
+PORTFOLIO_CACHE_TIMEOUT = env.int("PORTFOLIO_CACHE_TIMEOUT", default=3600)
+# Seconds for which portfolio users are cached by the dynamic CORS middleware
+PORTFOLIO_USER_CACHE_TIMEOUT = env.int(
+    "PORTFOLIO_USER_CACHE_TIMEOUT", default=300
+)
+# Seconds for which unknown portfolio user ids are cached
+PORTFOLIO_USER_NEGATIVE_CACHE_TIMEOUT = env.int(
+    "PORTFOLIO_USER_NEGATIVE_CACHE_TIMEOUT", default=60
+)
+# Seconds browsers may reuse single repo responses without revalidating them
+# (other portfolio responses are always revalidated, using ETags)
+PORTFOLIO_SINGLE_REPO_MAX_AGE = env.int(
+    "PORTFOLIO_SINGLE_REPO_MAX_AGE", default=300
+)
+# Encoder/decoder of REST API payloads: "orjson" (if installed) or "json"
+REST_API_JSON_BACKEND = env("REST_API_JSON_BACKEND", default="orjson")
+# Threads for concurrent DynamoDB/database fetches of REST API requests
+REST_API_BACKEND_WORKERS = env.int("REST_API_BACKEND_WORKERS", default=16)
+# Responses of at least this many bytes are compressed (brotli/gzip)
+REST_API_COMPRESSION_MIN_SIZE = env.int(
+    "REST_API_COMPRESSION_MIN_SIZE", default=1024
+)
+# Pre-render portfolio responses to JSON files on data changes and serve
+# those instead of querying (see `apps.rest_api.snapshots`)
+PORTFOLIO_SNAPSHOTS = env.bool("PORTFOLIO_SNAPSHOTS", default=False)
+PORTFOLIO_SNAPSHOTS_ROOT = env(
+    "PORTFOLIO_SNAPSHOTS_ROOT",
+    default=os.path.join(BASE_DIR, "portfolio_snapshots"),
+)
+# Threads regenerating snapshots in the background after data changes
+PORTFOLIO_SNAPSHOT_WORKERS = env.int("PORTFOLIO_SNAPSHOT_WORKERS", default=2)
+
+
+# Tech leaderboard
+
+# Refresh the leaderboard categories touched by tech analysis writes in the
+# background. When off, only `refresh_tech_leaderboard` refreshes it
+TECH_LEADERBOARD_INCREMENTAL = env.bool(
+    "TECH_LEADERBOARD_INCREMENTAL", default=True
+)
+# Seconds between background refreshes, touched categories are collected
+# meanwhile and refreshed together
+TECH_LEADERBOARD_REFRESH_INTERVAL = env.int(
+    "TECH_LEADERBOARD_REFRESH_INTERVAL", default=60
+)
+# Users stored with each leaderboard entry
+TECH_LEADERBOARD_TOP_USERS = env.int("TECH_LEADERBOARD_TOP_USERS", default=10)
+# Seconds for which leaderboard query results are cached
+TECH_LEADERBOARD_CACHE_TIMEOUT = env.int(
+    "TECH_LEADERBOARD_CACHE_TIMEOUT", default=300
+)
+
+
 # Theme build
 
 THEME_BUILD_USERNAME = env("THEME_BUILD_USERNAME", default="test")